@@ -1,7 +1,10 @@
 from django.contrib import admin
-from .models import Project, Certificate, Calculations
+from .models import Project, Certificate, Calculations, PdfRenderJob, ProjectLedger, RecalculationJob
 
 # Register your models here (for future database use)
 admin.site.register(Project)
 admin.site.register(Certificate)
 admin.site.register(Calculations)
+admin.site.register(PdfRenderJob)
+admin.site.register(ProjectLedger)
+admin.site.register(RecalculationJob)
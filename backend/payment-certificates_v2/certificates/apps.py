@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CertificatesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'certificates'
+
+    def ready(self):
+        # Connect the ledger signal handlers and register the deployment checks
+        from . import checks, signals
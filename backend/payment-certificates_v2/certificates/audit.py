@@ -0,0 +1,173 @@
+"""
+Buffered audit trail writer.
+
+record() builds an AuditLog entry and, once the current transaction commits,
+puts it on an in-process queue. A daemon thread writes the queue with one
+bulk_create every AUDIT_FLUSH_EVENTS entries or AUDIT_FLUSH_INTERVAL_MS
+milliseconds, whichever comes first, so auditing a request costs no INSERT
+of its own. Whatever is still queued when the worker exits is flushed by an
+atexit hook.
+
+If the bulk INSERT fails the batch is saved row by row, so one bad entry
+cannot lose the others. An entry that still fails goes back on the queue for
+the next flush, and is only logged and dropped after AUDIT_MAX_ATTEMPTS.
+
+With AUDIT_ASYNC = False every entry is saved immediately instead, which is
+what the test suite uses (see certificates/test_runner.py).
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .settings_cache import get_system_settings
+from .settings_models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+
+class AuditWriter:
+    def __init__(self, flush_events=100, flush_interval=1.0, max_queued=10000, max_attempts=5):
+        self.flush_events = flush_events
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.queue = queue.Queue(maxsize=max_queued)
+        self._wake = threading.Event()
+        # Held while draining, so flush() waits for a write already in progress
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def put(self, entry):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            # Never drop an audit entry; the caller pays for this one instead
+            logger.warning('Audit queue full, writing entry synchronously')
+            entry.save()
+            return
+        if self.queue.qsize() >= self.flush_events:
+            self._wake.set()
+
+    def flush(self):
+        """Write every queued entry now; returns the number written"""
+        with self._flush_lock:
+            entries = []
+            while True:
+                try:
+                    entries.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not entries:
+                return 0
+            try:
+                AuditLog.objects.bulk_create(entries, batch_size=500)
+                return len(entries)
+            except Exception as e:
+                logger.error(f'Failed to write {len(entries)} audit entries in bulk, saving them one by one: {str(e)}')
+            return self._save_each(entries)
+
+    def _save_each(self, entries):
+        written = 0
+        for entry in entries:
+            # bulk_create may have assigned a pk before its transaction rolled back
+            entry.pk = None
+            try:
+                entry.save(force_insert=True)
+                written += 1
+            except Exception as e:
+                self._retry(entry, e)
+        return written
+
+    def _retry(self, entry, error):
+        """Put an entry that could not be written back on the queue, until it has had max_attempts"""
+        entry.write_attempts = getattr(entry, 'write_attempts', 0) + 1
+        if entry.write_attempts < self.max_attempts:
+            try:
+                self.queue.put_nowait(entry)
+                return
+            except queue.Full:
+                pass
+        logger.error(
+            f'Dropping audit entry after {entry.write_attempts} attempt(s): {entry.action} {entry.model_name} '
+            f'{entry.object_id} by {entry.username or "System"} at {entry.timestamp}: {str(error)}'
+        )
+
+    def _ensure_started(self):
+        # A forked worker inherits the queue but not the thread, so start one per process
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            # The writer thread has its own connection; don't leave it open (or broken) between batches
+            connection.close()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AuditWriter(
+                flush_events=getattr(settings, 'AUDIT_FLUSH_EVENTS', 100),
+                flush_interval=getattr(settings, 'AUDIT_FLUSH_INTERVAL_MS', 1000) / 1000,
+                max_queued=getattr(settings, 'AUDIT_MAX_QUEUED', 10000),
+                max_attempts=getattr(settings, 'AUDIT_MAX_ATTEMPTS', 5),
+            )
+            atexit.register(_writer.flush)
+        return _writer
+
+
+def flush():
+    """Write any queued audit entries now"""
+    return _writer.flush() if _writer is not None else 0
+
+
+def record(action, model_name, description='', request=None, user=None, object_id=''):
+    """
+    Audit an action. user defaults to request.user; the IP address and user
+    agent come from request when given. Does nothing while
+    SystemSettings.enable_audit_trail is off.
+    """
+    if not get_system_settings().enable_audit_trail:
+        return
+
+    if user is None and request is not None:
+        user = request.user
+    if user is not None and not user.is_authenticated:
+        user = None
+    entry = AuditLog(
+        user_id=user.pk if user else None,
+        username=user.username if user else '',
+        action=action,
+        model_name=model_name,
+        object_id=str(object_id),
+        description=description,
+        ip_address=request.META.get('REMOTE_ADDR') if request else None,
+        user_agent=request.META.get('HTTP_USER_AGENT', '') if request else '',
+        timestamp=timezone.now(),
+    )
+
+    if not getattr(settings, 'AUDIT_ASYNC', True):
+        entry.save()
+        return
+    # Queue only committed work; a rolled-back change leaves no audit entry
+    transaction.on_commit(lambda: get_writer().put(entry))
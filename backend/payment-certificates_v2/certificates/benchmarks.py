@@ -0,0 +1,174 @@
+"""
+Benchmarks for the PDF, certificate save, project search, export, backup and
+statistics hot paths, plus a database-free microbenchmark of the certificate money
+arithmetic.
+
+Each benchmark runs against a synthetic dataset created with bulk_create so
+that building the dataset does not dominate the run. Results are plain
+dicts of milliseconds so they can be written to JSON and compared with a
+stored baseline by the run_benchmarks management command.
+"""
+import tempfile
+import time
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.test import Client, override_settings
+from django.urls import reverse
+from . import money
+from .models import (
+    Project, Certificate, Calculations, DEFAULT_VAT_RATE, DEFAULT_RETENTION_RATE, get_calculation_rates,
+)
+from .search import rebuild_search_index
+from .settings_models import AuditLog
+from .stats import rebuild_statistics
+from .utils import render_certificate_pdf
+
+PDF_SAMPLES = 20
+SAVE_SAMPLES = 100
+SEARCH_SAMPLES = 20
+MONEY_ROWS = 1000000
+
+
+def _timed(func, repeat=1):
+    """Average wall time of func in milliseconds"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def build_dataset(rows):
+    """Create roughly `rows` projects, certificates and audit log entries"""
+    owner = User.objects.create_user(username=f'bench_owner_{rows}', password='benchpass123')
+    admin = User.objects.create_superuser(username=f'bench_admin_{rows}', password='benchpass123')
+
+    projects = Project.objects.bulk_create([
+        Project(
+            name_of_contractor=f'Contractor {i}',
+            contract_no=f'BENCH-{rows}-{i}',
+            vote_no=f'V-{i}',
+            tender_sum=Decimal('1000000.00'),
+            owner=owner
+        )
+        for i in range(max(rows // 10, 1))
+    ], batch_size=1000)
+    # bulk_create skips the signals that keep the search index in sync
+    rebuild_search_index()
+
+    # The configured rates, so the dataset matches what the app itself would store
+    vat_rate, retention_rate = get_calculation_rates()
+    certificates = []
+    for i in range(rows):
+        certificate = Certificate(project=projects[i % len(projects)], current_claim_excl_vat=Decimal(1000 + i % 5000))
+        certificate.vat_value = certificate._calculate_vat(vat_rate)
+        certificates.append(certificate)
+    certificates = Certificate.objects.bulk_create(certificates, batch_size=1000)
+    Calculations.objects.bulk_create(
+        [Calculations(certificate=cert, **cert._calculate_values(vat_rate, retention_rate)) for cert in certificates],
+        batch_size=1000
+    )
+
+    AuditLog.objects.bulk_create([
+        AuditLog(user=owner, username=owner.username, action='VIEW', model_name='Certificate', object_id=str(i),
+                 description='Benchmark')
+        for i in range(rows)
+    ], batch_size=1000)
+    # Bulk inserts skip the statistics signals too
+    rebuild_statistics()
+
+    return owner, admin, projects
+
+
+def _consume(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def run_suite(rows):
+    """Run every benchmark against a dataset of `rows` rows and return timings in ms"""
+    owner, admin, projects = build_dataset(rows)
+    results = {}
+
+    certificate = Certificate.objects.select_related('project').with_calculations().first()
+    results['pdf_render'] = _timed(
+        lambda: render_certificate_pdf(certificate.project, certificate, certificate.get_calculations()),
+        repeat=PDF_SAMPLES
+    )
+
+    project = projects[0]
+    results['certificate_save'] = _timed(
+        lambda: Certificate.objects.create(project=project, current_claim_excl_vat=Decimal('1234.56')),
+        repeat=SAVE_SAMPLES
+    )
+    # Same writes without the Calculations row, to compare the two modes
+    with override_settings(CALCULATIONS_MODE='computed'):
+        results['certificate_save_computed'] = _timed(
+            lambda: Certificate.objects.create(project=project, current_claim_excl_vat=Decimal('1234.56')),
+            repeat=SAVE_SAMPLES
+        )
+
+    owner_client = Client()
+    owner_client.force_login(owner)
+    for name, query in [('project_search', f'BENCH-{rows}-{len(projects) - 1}'), ('project_search_fuzzy', 'Contrcator')]:
+        results[name] = _timed(
+            lambda: _consume(owner_client.get(reverse('project_search'), {'q': query})),
+            repeat=SEARCH_SAMPLES
+        )
+
+    client = Client()
+    client.force_login(admin)
+    for export_type in ['projects', 'certificates', 'audit_logs']:
+        results[f'export_{export_type}'] = _timed(
+            lambda: _consume(client.get(reverse('export_data'), {'type': export_type}))
+        )
+    results['export_certificates_wide'] = _timed(
+        lambda: _consume(client.get(reverse('export_data'), {'type': 'certificates', 'wide': '1'}))
+    )
+    # The backup leaves its manifest behind; keep it out of the real BACKUP_DIR
+    with tempfile.TemporaryDirectory() as backup_dir, override_settings(BACKUP_DIR=backup_dir):
+        results['system_backup'] = _timed(lambda: _consume(client.post(reverse('system_backup'))))
+    results['system_statistics'] = _timed(lambda: _consume(client.get(reverse('system_statistics'))))
+
+    return results
+
+
+def benchmark_money(rows=MONEY_ROWS):
+    """
+    Time the four certificate calculations for `rows` claims: with Decimals
+    quantized to cents (what the database does to the old unrounded values)
+    and with money.calculate_many, with and without converting the claims
+    to cents first.
+    """
+    claims = [Decimal(100 + i % 999983).scaleb(-2) for i in range(rows)]
+    vat_rate, retention_rate = DEFAULT_VAT_RATE, DEFAULT_RETENTION_RATE
+    vat_bp, retention_bp = money.to_basis_points(vat_rate), money.to_basis_points(retention_rate)
+    claims_cents = [money.to_cents(claim) for claim in claims]
+    cent = Decimal('0.01')
+
+    def with_decimals():
+        # Same columnar shape as calculate_many so both keep every result
+        vat = [(claim * vat_rate / 100).quantize(cent) for claim in claims]
+        incl_vat = [(claim + claim * vat_rate / 100).quantize(cent) for claim in claims]
+        retention = [(claim * retention_rate / 100).quantize(cent) for claim in claims]
+        payable = [(claim + claim * vat_rate / 100 - claim * retention_rate / 100).quantize(cent) for claim in claims]
+        return vat, incl_vat, retention, payable
+
+    return {
+        'money_decimal': _timed(with_decimals),
+        'money_cents': _timed(lambda: money.calculate_many(claims_cents, vat_bp, retention_bp)),
+        'money_cents_with_conversion': _timed(
+            lambda: money.calculate_many([money.to_cents(claim) for claim in claims], vat_bp, retention_bp)
+        ),
+    }
+
+
+def compare_to_baseline(results, baseline, threshold=1.25):
+    """Return (size, name, baseline_ms, current_ms) for every timing slower than threshold x baseline"""
+    regressions = []
+    for size, timings in results.items():
+        for name, current in timings.items():
+            previous = baseline.get(size, {}).get(name)
+            if previous and current > previous * threshold:
+                regressions.append((size, name, previous, current))
+    return regressions
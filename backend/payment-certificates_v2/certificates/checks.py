@@ -0,0 +1,26 @@
+"""
+System checks for deployment settings, run by `manage.py check --deploy`.
+"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Cache backends that keep their data inside one process or on one machine
+HOST_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """The SystemSettings version token (settings_cache.py) only reaches workers that share the cache"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend not in HOST_LOCAL_CACHES:
+        return []
+    return [Warning(
+        f'The default cache ({backend.rsplit(".", 1)[-1]}) is not shared between hosts, so a '
+        'SystemSettings change made on one host never reaches workers on the others.',
+        hint='Set REDIS_URL (or another shared cache backend) whenever the site runs on more than one host.',
+        id='certificates.W001',
+    )]
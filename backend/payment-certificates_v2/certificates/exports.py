@@ -0,0 +1,195 @@
+"""
+Streaming CSV exports for export_data.
+
+Each export is a values_list() query read with iterator(chunk_size=...), so
+rows are fetched a chunk at a time (through a server-side cursor on
+PostgreSQL) and never built into model instances. stream_csv() writes them
+into a small text buffer and yields it every CSV_CHUNK_BYTES, so memory stays
+flat however many rows there are. The header row is yielded before the query
+runs, which gets the first bytes to the client straight away.
+
+Rows are read in primary key (audit logs: timestamp) order, which the
+database can stream from an index instead of sorting the whole table first.
+
+Delta exports take a `since` watermark and return only the rows whose
+updated_at (audit logs: timestamp) falls in (since, until], read in that
+order from the (updated_at, id) indexes. Deleted projects and certificates
+are listed by the 'deletions' export from their Tombstone rows. until lags
+EXPORT_WATERMARK_LAG_SECONDS behind the clock, so a transaction that was
+still open when the export ran is picked up by the next one rather than
+skipped; it is the watermark to pass next time.
+"""
+import csv
+import io
+import zlib
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from . import money
+from .models import Project, Certificate, Tombstone, CALCULATION_FIELDS
+from .settings_models import AuditLog
+
+ROW_CHUNK_SIZE = 2000
+CSV_CHUNK_BYTES = 64 * 1024
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _date(value):
+    return value.strftime(DATE_FORMAT) if value else ''
+
+
+def _amount(value):
+    # Computed-mode calculations carry six decimal places; export cents like get_calculations()
+    return money.round_decimal(value) if value is not None else ''
+
+
+def parse_watermark(value):
+    """A watermark string as an aware datetime (naive ones are UTC); ValueError if it is not one"""
+    moment = parse_datetime(value.strip())
+    if moment is None:
+        raise ValueError(f'Invalid watermark: {value!r}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, dt_timezone.utc)
+    return moment
+
+
+def format_watermark(moment):
+    return moment.astimezone(dt_timezone.utc).isoformat()
+
+
+def next_watermark(since=None):
+    """Upper bound for an export starting now; never earlier than since"""
+    lag = getattr(settings, 'EXPORT_WATERMARK_LAG_SECONDS', 60)
+    until = timezone.now() - timedelta(seconds=lag)
+    return max(until, since) if since is not None else until
+
+
+def _window(queryset, field, since, until):
+    """Every row in primary key order, or those whose field is in (since, until] in field order"""
+    if since is None:
+        return queryset.order_by('pk')
+    return queryset.filter(**{f'{field}__gt': since, f'{field}__lte': until}).order_by(field, 'pk')
+
+
+def _projects(since, until):
+    rows = _window(Project.objects.all(), 'updated_at', since, until).values_list(
+        'pk', 'name_of_contractor', 'contract_no', 'vote_no', 'tender_sum', 'owner__username', 'created_at'
+    )
+    for *values, created_at in rows.iterator(chunk_size=ROW_CHUNK_SIZE):
+        yield [*values, _date(created_at)]
+
+
+def _certificates(since, until):
+    rows = _window(Certificate.objects.all(), 'updated_at', since, until).values_list(
+        'pk', 'project__name_of_contractor', 'currency', 'current_claim_excl_vat', 'vat_value',
+        'previous_payment_excl_vat', 'created_at'
+    )
+    for *values, created_at in rows.iterator(chunk_size=ROW_CHUNK_SIZE):
+        yield [*values, _date(created_at)]
+
+
+def _certificates_wide(since, until):
+    # Project columns and calculated totals come from the same query as the certificate. A delta
+    # follows the certificate's updated_at only; project edits arrive through the projects delta
+    rows = _window(Certificate.objects.with_calculations(), 'updated_at', since, until).values_list(
+        'pk', 'project_id', 'project__contract_no', 'project__vote_no', 'project__name_of_contractor',
+        'currency', 'current_claim_excl_vat', 'vat_value', 'previous_payment_excl_vat',
+        *[f'calc_{field}' for field in CALCULATION_FIELDS], 'created_at'
+    )
+    calculated = len(CALCULATION_FIELDS)
+    for row in rows.iterator(chunk_size=ROW_CHUNK_SIZE):
+        values, calculations, created_at = row[:-calculated - 1], row[-calculated - 1:-1], row[-1]
+        yield [*values, *map(_amount, calculations), _date(created_at)]
+
+
+def _audit_logs(since, until):
+    logs = AuditLog.objects.all()
+    if since is not None:
+        logs = logs.filter(timestamp__gt=since, timestamp__lte=until)
+    rows = logs.order_by('timestamp', 'id').values_list(
+        'username', 'action', 'model_name', 'object_id', 'description', 'ip_address', 'timestamp'
+    )
+    for username, *values, timestamp in rows.iterator(chunk_size=ROW_CHUNK_SIZE):
+        yield [username or 'System', *values, _date(timestamp)]
+
+
+def _deletions(since, until):
+    tombstones = Tombstone.objects.all()
+    if since is not None:
+        tombstones = tombstones.filter(deleted_at__gt=since, deleted_at__lte=until)
+    rows = tombstones.order_by('deleted_at', 'id').values_list('model_name', 'object_id', 'deleted_at')
+    for model_name, object_id, deleted_at in rows.iterator(chunk_size=ROW_CHUNK_SIZE):
+        yield [model_name, object_id, _date(deleted_at)]
+
+
+# export type -> (file name, header, row generator)
+EXPORTS = {
+    'projects': (
+        'projects.csv',
+        ['ID', 'Contractor', 'Contract No', 'Vote No', 'Tender Sum', 'Owner', 'Created At'],
+        _projects,
+    ),
+    'certificates': (
+        'certificates.csv',
+        ['ID', 'Project', 'Currency', 'Current Claim', 'VAT', 'Previous Payment', 'Created At'],
+        _certificates,
+    ),
+    'certificates_wide': (
+        'certificates_wide.csv',
+        ['ID', 'Project ID', 'Contract No', 'Vote No', 'Contractor', 'Currency', 'Current Claim', 'VAT',
+         'Previous Payment', 'Value of Work Done (incl. VAT)', 'Total Value of Work Done (excl. VAT)',
+         'Retention', 'Total Amount Payable', 'Created At'],
+        _certificates_wide,
+    ),
+    'audit_logs': (
+        'audit_logs.csv',
+        ['User', 'Action', 'Model', 'Object ID', 'Description', 'IP Address', 'Timestamp'],
+        _audit_logs,
+    ),
+    'deletions': (
+        'deletions.csv',
+        ['Model', 'Object ID', 'Deleted At'],
+        _deletions,
+    ),
+}
+
+
+def export_rows(export_type, since=None, until=None):
+    """(file name, header, rows) for an export; since=None exports everything"""
+    filename, header, rows = EXPORTS[export_type]
+    return filename, header, rows(since, until)
+
+
+def stream_csv(header, rows):
+    """Yield header and rows as UTF-8 CSV, in chunks of about CSV_CHUNK_BYTES"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate()
+
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CSV_CHUNK_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_stream(chunks, level=6):
+    """Compress a byte stream into a gzip file on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    first = True
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if first:
+            # Push the gzip header and CSV header out now rather than after the first full block
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            first = False
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,78 @@
+"""
+The database-backed job queue shared by PDF rendering (pdf_jobs.py) and
+certificate recalculation (recalculation.py).
+
+Jobs are rows with status PENDING -> RUNNING -> DONE/FAILED, an attempts
+count, started_at/finished_at and a heartbeat field that a worker moves
+while it makes progress (for PDF jobs, which finish in one step, that is
+started_at itself). Workers claim a job with a conditional UPDATE, so two
+workers never run the same one. A RUNNING job whose heartbeat is older
+than the timeout belonged to a worker that died; reclaim_stale() puts it
+back in the queue, or fails it once it has been tried max_attempts times.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Exists, F
+from django.utils import timezone
+
+
+class JobQueue:
+    def __init__(self, model, description, timeout_setting, max_attempts_setting, logger,
+                 heartbeat_field='started_at', exclusive=False, select_related=()):
+        self.model = model
+        # Used in messages, e.g. 'PDF job'
+        self.description = description
+        self.timeout_setting = timeout_setting
+        self.max_attempts_setting = max_attempts_setting
+        self.logger = logger
+        self.heartbeat_field = heartbeat_field
+        # Only one job may run at a time, e.g. so an older rate change never finishes after a newer one
+        self.exclusive = exclusive
+        self.select_related = select_related
+
+    def reclaim_stale(self):
+        """Requeue (or fail, after max_attempts) jobs whose worker stopped making progress"""
+        timeout = getattr(settings, self.timeout_setting, 600)
+        max_attempts = getattr(settings, self.max_attempts_setting, 3)
+        now = timezone.now()
+        stale = self.model.objects.filter(
+            status='RUNNING', **{f'{self.heartbeat_field}__lt': now - timedelta(seconds=timeout)}
+        )
+        failed = stale.filter(attempts__gte=max_attempts).update(
+            status='FAILED',
+            error=f'{self.description} did not finish after {max_attempts} attempts',
+            finished_at=now
+        )
+        requeued = stale.filter(attempts__lt=max_attempts).update(status='PENDING', started_at=None)
+        if failed or requeued:
+            self.logger.warning(f'Reclaimed stale {self.description}s: {requeued} requeued, {failed} failed')
+        return requeued + failed
+
+    def claim_next(self):
+        """Atomically move the oldest pending job to RUNNING and return it"""
+        for job_id in self.model.objects.filter(status='PENDING').values_list('id', flat=True)[:10]:
+            # The conditional update only succeeds for one worker per job
+            candidate = self.model.objects.filter(pk=job_id, status='PENDING')
+            if self.exclusive:
+                candidate = candidate.filter(~Exists(self.model.objects.filter(status='RUNNING')))
+            now = timezone.now()
+            claimed = candidate.update(
+                status='RUNNING',
+                attempts=F('attempts') + 1,
+                **{'started_at': now, self.heartbeat_field: now}
+            )
+            if claimed:
+                return self.model.objects.select_related(*self.select_related).get(pk=job_id)
+        return None
+
+    def process_pending(self, process_job, limit=None):
+        """Run process_job on queued jobs until the queue is empty or limit is reached"""
+        self.reclaim_stale()
+        processed = 0
+        while limit is None or processed < limit:
+            job = self.claim_next()
+            if job is None:
+                break
+            process_job(job)
+            processed += 1
+        return processed
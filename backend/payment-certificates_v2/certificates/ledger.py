@@ -0,0 +1,118 @@
+"""
+Incremental maintenance of ProjectLedger totals.
+
+Signal handlers apply the change from a single certificate as a delta with
+F() expressions; bulk writes either pass their own deltas or rebuild the
+affected ledgers from scratch with rebuild_ledgers.
+"""
+from decimal import Decimal
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, Sum, Value, When
+from django.db.models.functions import Abs, Floor, Mod, Round
+from django.db.models.lookups import Exact, GreaterThan
+from .models import Project, Certificate, Calculations, ProjectLedger, calculations_stored
+from .money import SCALE, from_cents
+
+ZERO = Decimal('0.00')
+
+# ProjectLedger field -> Calculations field it sums
+LEDGER_SOURCES = {
+    'claimed_to_date': 'total_value_of_workdone_excl_vat',
+    'value_incl_vat_to_date': 'value_of_workdone_incl_vat',
+    'retention_held': 'retention',
+    'total_paid': 'total_amount_payable',
+}
+
+
+def apply_delta(project_id, count, amounts, rebuild_missing=True):
+    """
+    Add count certificates and the given amounts (one per LEDGER_SOURCES
+    entry, in order) to a project's ledger. A missing ledger is rebuilt
+    from scratch unless rebuild_missing is False.
+    """
+    changes = {'certificate_count': F('certificate_count') + count}
+    for field, amount in zip(LEDGER_SOURCES, amounts):
+        if amount:
+            changes[field] = F(field) + amount
+    updated = ProjectLedger.objects.filter(project_id=project_id).update(**changes)
+    if not updated and rebuild_missing:
+        # No ledger yet (e.g. a project from before ledgers existed): build it from scratch
+        rebuild_ledgers(Project.objects.filter(pk=project_id))
+
+
+def _cents(expression):
+    """
+    expression in whole cents, rounded half to even in the database exactly
+    as money.round_decimal rounds it in Python
+    """
+    # Units of 1e-6, snapped to whole units to absorb float noise (SQLite)
+    scaled = Round(ExpressionWrapper(
+        expression * Value(10 ** 6), output_field=DecimalField(max_digits=24, decimal_places=6)
+    ))
+    cents = Floor(scaled / Value(SCALE))
+    doubled = (scaled - cents * Value(SCALE)) * Value(2)
+    return Case(
+        When(GreaterThan(doubled, Value(SCALE)), then=cents + Value(1)),
+        When(Exact(doubled, Value(SCALE)), then=cents + Abs(Mod(cents, Value(2)))),
+        default=cents,
+    )
+
+
+def _totals_for(project_ids):
+    if not calculations_stored():
+        # Each certificate's value is rounded to cents before it is added, as get_calculations()
+        # shows it, so the ledger is the sum of the figures on the certificates
+        rows = Certificate.objects.filter(project_id__in=project_ids).with_calculations().values(
+            'project_id'
+        ).annotate(
+            certificate_count=Count('pk'),
+            **{field: Sum(_cents(F(f'calc_{source}'))) for field, source in LEDGER_SOURCES.items()}
+        )
+        return {
+            row.pop('project_id'): {
+                field: from_cents(int(value)) if value is not None and field in LEDGER_SOURCES else value
+                for field, value in row.items()
+            }
+            for row in rows
+        }
+
+    rows = Calculations.objects.filter(certificate__project_id__in=project_ids).values(
+        'certificate__project_id'
+    ).annotate(
+        certificate_count=Count('pk'),
+        **{field: Sum(source) for field, source in LEDGER_SOURCES.items()}
+    )
+    return {row.pop('certificate__project_id'): row for row in rows}
+
+
+def rebuild_ledgers(queryset=None, batch_size=1000):
+    """Recompute ledgers for every project in queryset in primary-key batches; returns the number rebuilt"""
+    if queryset is None:
+        queryset = Project.objects.all()
+    queryset = queryset.order_by('pk')
+
+    rebuilt = 0
+    last_pk = 0
+    while True:
+        project_ids = list(queryset.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+        if not project_ids:
+            break
+        last_pk = project_ids[-1]
+
+        totals = _totals_for(project_ids)
+        ledgers = []
+        for project_id in project_ids:
+            row = totals.get(project_id, {})
+            ledgers.append(ProjectLedger(
+                project_id=project_id,
+                certificate_count=row.get('certificate_count', 0),
+                **{field: row.get(field) or ZERO for field in LEDGER_SOURCES}
+            ))
+        ProjectLedger.objects.bulk_create(
+            ledgers,
+            update_conflicts=True,
+            unique_fields=['project'],
+            update_fields=['certificate_count', *LEDGER_SOURCES, 'updated_at'],
+        )
+        rebuilt += len(project_ids)
+
+    return rebuilt
@@ -0,0 +1,18 @@
+import json
+from django.core.management.base import BaseCommand
+from certificates.backup import write_backup, manifest_path, BACKUP_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Write a gzip-compressed backup of the database and its manifest to BACKUP_DIR'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=BACKUP_CHUNK_SIZE,
+                            help='Rows serialized per query')
+
+    def handle(self, *args, **options):
+        path = write_backup(chunk_size=options['chunk_size'])
+        manifest = json.loads(manifest_path(path.name).read_text())
+        self.stdout.write(self.style.SUCCESS(
+            f'Backed up {manifest["rows"]} rows to {path} ({manifest["bytes"]} bytes, sha256 {manifest["sha256"]})'
+        ))
@@ -0,0 +1,55 @@
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from certificates.models import Project, Certificate, Calculations, get_calculation_rates
+from certificates.pdf_layout import CertificateLayout, DEFAULTS, LAYOUT_FIELDS, get_layout
+from certificates.utils import render_certificate_pdf
+
+
+class Command(BaseCommand):
+    help = 'Time certificate PDF rendering with a per-render layout versus the cached layout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+
+        # Unsaved instances keep the benchmark off the database
+        project = Project(
+            name_of_contractor='Benchmark Contractor',
+            contract_no='BENCH-001',
+            vote_no='V-BENCH',
+            tender_sum=Decimal('1000000.00')
+        )
+        certificate = Certificate(id=1, project=project, currency='USD',
+                                  current_claim_excl_vat=Decimal('12345.67'),
+                                  previous_payment_excl_vat=Decimal('1000.00'))
+        # Same figures the app would render with the configured rates
+        vat_rate, retention_rate = get_calculation_rates()
+        certificate.vat_value = certificate._calculate_vat(vat_rate)
+        calculations = Calculations(certificate=certificate,
+                                    **certificate._calculate_values(vat_rate, retention_rate))
+        layout_values = [DEFAULTS[field] for field in LAYOUT_FIELDS]
+
+        def uncached():
+            layout = CertificateLayout(*layout_values)
+            render_certificate_pdf(project, certificate, calculations, 'January 01, 2024', layout)
+
+        def cached():
+            render_certificate_pdf(project, certificate, calculations, 'January 01, 2024', get_layout())
+
+        # Warm up imports and font metrics before timing
+        uncached()
+        cached()
+
+        results = {}
+        for name, func in [('per-render layout', uncached), ('cached layout', cached)]:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                func()
+            results[name] = (time.perf_counter() - start) / iterations * 1000
+            self.stdout.write(f'{name}: {results[name]:.3f} ms/render')
+
+        saved = results['per-render layout'] - results['cached layout']
+        self.stdout.write(self.style.SUCCESS(f'Saved {saved:.3f} ms per render over {iterations} iterations'))
@@ -0,0 +1,57 @@
+import os
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from certificates.exports import (
+    EXPORTS, export_rows, stream_csv, gzip_stream, parse_watermark, format_watermark, next_watermark,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Write a CSV export to a file, optionally only the rows changed since a watermark. With '
+        '--watermark-file the watermark is read from the file and the next one written back once the '
+        'export has finished, so a nightly job only ever pulls what changed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('type', choices=list(EXPORTS))
+        parser.add_argument('--output', required=True, help='File to write the CSV to')
+        parser.add_argument('--since', help='Only export rows changed after this ISO 8601 watermark')
+        parser.add_argument('--watermark-file', help='Read --since from this file and store the next watermark in it')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip')
+
+    def handle(self, *args, **options):
+        watermark_file = Path(options['watermark_file']) if options['watermark_file'] else None
+        since = options['since']
+        if since is None and watermark_file is not None and watermark_file.exists():
+            since = watermark_file.read_text().strip() or None
+        try:
+            since = parse_watermark(since) if since else None
+        except ValueError as e:
+            raise CommandError(str(e))
+        until = next_watermark(since)
+
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        _, header, rows = export_rows(options['type'], since, until)
+        content = stream_csv(header, counted(rows))
+        if options['gzip']:
+            content = gzip_stream(content)
+        with open(options['output'], 'wb') as output:
+            for chunk in content:
+                output.write(chunk)
+
+        if watermark_file is not None:
+            # Only a finished export moves the watermark on; replace the file in one step
+            temporary = watermark_file.with_name(watermark_file.name + '.tmp')
+            temporary.write_text(format_watermark(until) + '\n')
+            os.replace(temporary, watermark_file)
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {count} {options["type"]} rows to {options["output"]}; next watermark {format_watermark(until)}'
+        ))
@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from certificates.pdf_jobs import process_pending, purge_finished_jobs
+
+
+class Command(BaseCommand):
+    help = 'Render queued certificate PDFs and delete finished jobs past PDF_JOB_RETENTION_DAYS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--purge-interval', type=float, default=3600.0,
+                            help='Seconds between deletions of old finished jobs')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            processed = process_pending()
+            purged = purge_finished_jobs()
+            self.stdout.write(self.style.SUCCESS(f'Processed {processed} PDF job(s), purged {purged} old job(s)'))
+            return
+
+        self.stdout.write('Waiting for PDF jobs...')
+        last_purge = None
+        try:
+            while True:
+                if last_purge is None or time.monotonic() - last_purge >= options['purge_interval']:
+                    purged = purge_finished_jobs()
+                    if purged:
+                        self.stdout.write(f'Purged {purged} old PDF job(s)')
+                    last_purge = time.monotonic()
+                processed = process_pending()
+                if processed:
+                    self.stdout.write(f'Processed {processed} PDF job(s)')
+                else:
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping PDF worker')
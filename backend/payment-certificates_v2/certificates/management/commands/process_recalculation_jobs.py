@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+from certificates.recalculation import process_pending
+
+
+class Command(BaseCommand):
+    help = 'Run queued certificate recalculations after VAT/retention rate changes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+        parser.add_argument('--sleep', type=float, default=5.0, help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            processed = process_pending()
+            self.stdout.write(self.style.SUCCESS(f'Processed {processed} recalculation job(s)'))
+            return
+
+        self.stdout.write('Waiting for recalculation jobs...')
+        try:
+            while True:
+                processed = process_pending()
+                if processed:
+                    self.stdout.write(f'Processed {processed} recalculation job(s)')
+                else:
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping recalculation worker')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from certificates.ledger import rebuild_ledgers
+
+
+class Command(BaseCommand):
+    help = 'Recompute every project ledger from its certificates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding project ledgers...')
+        count = rebuild_ledgers(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} project ledgers'))
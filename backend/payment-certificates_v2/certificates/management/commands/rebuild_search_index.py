@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from certificates.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Refill the project search index, e.g. after loading projects with bulk_create'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding project search index...')
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} projects'))
@@ -0,0 +1,24 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from certificates.models import get_calculation_rates
+from certificates.recalculation import recalculate_certificates, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Recompute VAT and calculations for all certificates at the current (or given) rates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vat-rate', type=Decimal, help='VAT percentage, defaults to SystemSettings')
+        parser.add_argument('--retention-rate', type=Decimal, help='Retention percentage, defaults to SystemSettings')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        vat_rate, retention_rate = get_calculation_rates()
+        if options['vat_rate'] is not None:
+            vat_rate = options['vat_rate']
+        if options['retention_rate'] is not None:
+            retention_rate = options['retention_rate']
+
+        self.stdout.write(f'Recalculating certificates at VAT {vat_rate}% and retention {retention_rate}%...')
+        count = recalculate_certificates(vat_rate, retention_rate, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Recalculated {count} certificates'))
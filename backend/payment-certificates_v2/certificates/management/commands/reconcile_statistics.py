@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from certificates.stats import rebuild_statistics
+
+
+class Command(BaseCommand):
+    help = 'Recount the statistics page counters from the tables and report any drift'
+
+    def handle(self, *args, **options):
+        drift = rebuild_statistics()
+        for name, stored, actual in drift:
+            self.stdout.write(self.style.WARNING(f'{name}: stored {stored}, actual {actual}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Statistics reconciled, {len(drift)} counter(s) corrected' if drift else 'Statistics were already correct'
+        ))
@@ -0,0 +1,76 @@
+import json
+from datetime import datetime
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from certificates import audit
+from certificates.benchmarks import run_suite, benchmark_money, compare_to_baseline, MONEY_ROWS
+
+
+class Command(BaseCommand):
+    help = 'Benchmark PDF rendering, certificate saves, CSV exports and backups on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help='Comma-separated dataset sizes (rows)')
+        parser.add_argument('--money-rows', type=int, default=MONEY_ROWS,
+                            help='Claims in the money arithmetic microbenchmark (0 to skip)')
+        parser.add_argument('--output', default='benchmark_results.json',
+                            help='Where to write the JSON results')
+        parser.add_argument('--baseline', help='JSON results from a previous run to compare against')
+        parser.add_argument('--threshold', type=float, default=1.25,
+                            help='Flag timings slower than threshold x baseline')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+
+        # Benchmarks run against a throwaway database so real data is never touched
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        results = {}
+        try:
+            for size in sizes:
+                self.stdout.write(f'Running benchmarks with {size} rows...')
+                results[str(size)] = run_suite(size)
+                for name, elapsed in results[str(size)].items():
+                    self.stdout.write(f'  {name}: {elapsed:.2f} ms')
+                # Write queued audit entries while the users they point at still exist
+                audit.flush()
+                call_command('flush', interactive=False, verbosity=0)
+        finally:
+            # Queued entries belong in the throwaway database; the atexit flush would come too late
+            audit.flush()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['money_rows']:
+            self.stdout.write(f'Running money arithmetic with {options["money_rows"]} claims...')
+            results['money'] = benchmark_money(options['money_rows'])
+            for name, elapsed in results['money'].items():
+                self.stdout.write(f'  {name}: {elapsed:.2f} ms')
+
+        report = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'results': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
+
+        if not options['baseline']:
+            return
+
+        with open(options['baseline']) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_to_baseline(results, baseline, options['threshold'])
+        for size, name, previous, current in regressions:
+            self.stdout.write(self.style.WARNING(
+                f'Regression: {name} at {size} rows {previous:.2f} ms -> {current:.2f} ms'
+            ))
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('No regressions against baseline'))
+        elif options['fail_on_regression']:
+            raise CommandError(f'{len(regressions)} benchmark regression(s) found')
@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from certificates.ledger import rebuild_ledgers
+from certificates.models import Certificate, Calculations, CALCULATION_FIELDS, get_calculation_rates
+from certificates.money import calculation_values
+from certificates.recalculation import recalculate_certificates
+
+
+class Command(BaseCommand):
+    help = (
+        'Move certificate data to the CALCULATIONS_MODE set in settings. "computed" checks the stored '
+        'Calculations rows against the computed values and, with --delete-rows, empties the table; '
+        '"stored" writes a Calculations row for every certificate again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('mode', choices=['stored', 'computed'])
+        parser.add_argument('--delete-rows', action='store_true',
+                            help='Empty the Calculations table once it matches the computed values')
+        parser.add_argument('--force', action='store_true', help='Delete rows even if some values differ')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        mode = options['mode']
+        if getattr(settings, 'CALCULATIONS_MODE', 'stored') != mode:
+            raise CommandError(f'Set CALCULATIONS_MODE = "{mode}" in settings before running this command')
+
+        if mode == 'stored':
+            count = recalculate_certificates(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Stored calculations for {count} certificates'))
+            return
+
+        checked, mismatched = self.compare(options['batch_size'])
+        self.stdout.write(f'Checked {checked} stored calculations, {mismatched} differ from the computed values')
+        if not options['delete_rows']:
+            return
+        if mismatched and not options['force']:
+            raise CommandError('Run recalculate_certificates first, or pass --force to delete anyway')
+
+        with transaction.atomic():
+            # One DELETE statement skips the per-row ledger signals (nothing references
+            # Calculations, so there is no cascade to miss); the ledgers are recounted below
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {connection.ops.quote_name(Calculations._meta.db_table)}')
+                deleted = cursor.rowcount
+            rebuild_ledgers()
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} Calculations rows; the table can now be dropped'
+        ))
+
+    def compare(self, batch_size):
+        """Count stored rows that differ from what computed mode would return"""
+        vat_rate, retention_rate = get_calculation_rates()
+        checked = mismatched = 0
+        last_pk = 0
+        while True:
+            rows = list(Certificate.objects.filter(
+                pk__gt=last_pk, calculations__isnull=False
+            ).order_by('pk').values_list(
+                'pk', 'current_claim_excl_vat', *[f'calculations__{field}' for field in CALCULATION_FIELDS]
+            )[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+
+            for pk, claim, *stored in rows:
+                values = calculation_values(claim, vat_rate, retention_rate)
+                computed = [values[field] for field in CALCULATION_FIELDS]
+                if computed != stored:
+                    mismatched += 1
+                    self.stdout.write(self.style.WARNING(f'Certificate {pk}: stored {stored}, computed {computed}'))
+            checked += len(rows)
+        return checked, mismatched
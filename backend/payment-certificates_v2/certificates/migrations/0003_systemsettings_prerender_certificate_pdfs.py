@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('certificates', '0002_pdfrenderjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemsettings',
+            name='prerender_certificate_pdfs',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def build_ledgers(apps, schema_editor):
+    Project = apps.get_model('certificates', 'Project')
+    Calculations = apps.get_model('certificates', 'Calculations')
+    ProjectLedger = apps.get_model('certificates', 'ProjectLedger')
+
+    totals = {
+        row['certificate__project_id']: row
+        for row in Calculations.objects.values('certificate__project_id').annotate(
+            certificate_count=Count('pk'),
+            claimed_to_date=Sum('total_value_of_workdone_excl_vat'),
+            value_incl_vat_to_date=Sum('value_of_workdone_incl_vat'),
+            retention_held=Sum('retention'),
+            total_paid=Sum('total_amount_payable'),
+        )
+    }
+    ledgers = []
+    for project_id in Project.objects.values_list('pk', flat=True).iterator():
+        row = totals.get(project_id, {})
+        ledgers.append(ProjectLedger(
+            project_id=project_id,
+            certificate_count=row.get('certificate_count', 0),
+            claimed_to_date=row.get('claimed_to_date') or 0,
+            value_incl_vat_to_date=row.get('value_incl_vat_to_date') or 0,
+            retention_held=row.get('retention_held') or 0,
+            total_paid=row.get('total_paid') or 0,
+        ))
+    ProjectLedger.objects.bulk_create(ledgers, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('certificates', '0004_bulkcertificaterequest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectLedger',
+            fields=[
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ledger', serialize=False, to='certificates.project')),
+                ('certificate_count', models.PositiveIntegerField(default=0)),
+                ('claimed_to_date', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('value_incl_vat_to_date', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('retention_held', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_paid', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(build_ledgers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+SEARCH_FIELDS = ['name_of_contractor', 'contract_no', 'vote_no']
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        columns = ', '.join(SEARCH_FIELDS)
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE certificates_project_fts USING fts5({columns}, tokenize='trigram')"
+        )
+        schema_editor.execute(
+            f'INSERT INTO certificates_project_fts (rowid, {columns}) SELECT id, {columns} FROM certificates_project'
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for field in SEARCH_FIELDS:
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS certificates_project_{field}_trgm '
+                f'ON certificates_project USING gin ({field} gin_trgm_ops)'
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS certificates_project_fts')
+    elif vendor == 'postgresql':
+        for field in SEARCH_FIELDS:
+            schema_editor.execute(f'DROP INDEX IF EXISTS certificates_project_{field}_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('certificates', '0006_auditlog_timestamp_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_usernames(apps, schema_editor):
+    AuditLog = apps.get_model('certificates', 'AuditLog')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    # One UPDATE, run before the new indexes exist so it does not maintain them
+    AuditLog.objects.filter(user__isnull=False).update(
+        username=Subquery(User.objects.filter(pk=OuterRef('user_id')).values('username')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('certificates', '0007_project_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='auditlog',
+            name='username',
+            field=models.CharField(blank=True, max_length=150),
+        ),
+        migrations.RunPython(copy_usernames, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='auditlog',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['action', 'timestamp'], name='certificate_action_0891e2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['model_name', 'timestamp'], name='certificate_model_n_9284c8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['user', 'timestamp'], name='certificate_user_id_35c773_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['username', 'timestamp'], name='certificate_usernam_f3441a_idx'),
+        ),
+    ]
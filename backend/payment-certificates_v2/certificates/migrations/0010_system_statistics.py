@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:01
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DateField
+from django.db.models.functions import TruncMonth
+
+
+def build_statistics(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Project = apps.get_model('certificates', 'Project')
+    Certificate = apps.get_model('certificates', 'Certificate')
+    SystemStatistics = apps.get_model('certificates', 'SystemStatistics')
+    MonthlyStatistics = apps.get_model('certificates', 'MonthlyStatistics')
+
+    def per_month(model):
+        return dict(
+            model.objects.annotate(month=TruncMonth('created_at', output_field=DateField()))
+            .values('month').annotate(count=Count('pk')).order_by().values_list('month', 'count')
+        )
+
+    SystemStatistics.objects.create(
+        pk=1,
+        user_count=User.objects.count(),
+        active_user_count=User.objects.filter(last_login__isnull=False).count(),
+        project_count=Project.objects.count(),
+        certificate_count=Certificate.objects.count(),
+    )
+    projects = per_month(Project)
+    certificates = per_month(Certificate)
+    MonthlyStatistics.objects.bulk_create([
+        MonthlyStatistics(month=month, project_count=projects.get(month, 0), certificate_count=certificates.get(month, 0))
+        for month in sorted(set(projects) | set(certificates))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('certificates', '0009_auditlog_timestamp_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('project_count', models.BigIntegerField(default=0)),
+                ('certificate_count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Monthly Statistics',
+                'ordering': ['month'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SystemStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_count', models.BigIntegerField(default=0)),
+                ('active_user_count', models.BigIntegerField(default=0)),
+                ('project_count', models.BigIntegerField(default=0)),
+                ('certificate_count', models.BigIntegerField(default=0)),
+                ('reconciled_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'System Statistics',
+                'verbose_name_plural': 'System Statistics',
+            },
+        ),
+        migrations.RunPython(build_statistics, migrations.RunPython.noop),
+    ]
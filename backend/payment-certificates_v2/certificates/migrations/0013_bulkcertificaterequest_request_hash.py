@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('certificates', '0012_pdfrenderjob_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkcertificaterequest',
+            name='request_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
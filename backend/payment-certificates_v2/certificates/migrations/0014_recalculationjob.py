@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('certificates', '0013_bulkcertificaterequest_request_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecalculationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vat_rate', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('retention_rate', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed'), ('SUPERSEDED', 'Superseded')], default='PENDING', max_length=10)),
+                ('last_pk', models.BigIntegerField(default=0)),
+                ('updated_count', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='certificate_status_73f5ec_idx')],
+            },
+        ),
+    ]
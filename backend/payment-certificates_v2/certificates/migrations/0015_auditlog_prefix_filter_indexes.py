@@ -0,0 +1,34 @@
+from django.db import migrations
+
+# Audit log filters that accept a prefix ending in *
+PREFIX_FIELDS = ['username', 'model_name']
+
+
+def create_prefix_indexes(apps, schema_editor):
+    # Under a locale collation PostgreSQL only uses an index for LIKE 'prefix%'
+    # when it is built with varchar_pattern_ops; SQLite filters on a range instead
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in PREFIX_FIELDS:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS certificates_auditlog_{field}_like '
+            f'ON certificates_auditlog ({field} varchar_pattern_ops)'
+        )
+
+
+def drop_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in PREFIX_FIELDS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS certificates_auditlog_{field}_like')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('certificates', '0014_recalculationjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_indexes, drop_prefix_indexes),
+    ]
@@ -4,6 +4,10 @@ Mock data for the certificates app (since we're not using a database)
 from decimal import Decimal
 import uuid
 from datetime import datetime
+from . import money
+
+MOCK_VAT_RATE = Decimal('15.00')
+MOCK_RETENTION_RATE = Decimal('10.00')
 
 
 class MockProject:
@@ -22,7 +26,8 @@ class MockCertificate:
         self.project_id = project_id
         self.currency = currency
         self.current_claim_excl_vat = Decimal(str(current_claim_excl_vat))
-        self.vat_value = self.current_claim_excl_vat * Decimal('0.15')
+        claim_cents = money.to_cents(self.current_claim_excl_vat)
+        self.vat_value = money.from_cents(money.percent_of(claim_cents, money.to_basis_points(MOCK_VAT_RATE)))
         self.previous_payment_excl_vat = Decimal(str(previous_payment_excl_vat))
         self.created_at = datetime.now()
 
@@ -30,10 +35,11 @@ class MockCertificate:
 class MockCalculations:
     def __init__(self, certificate):
         self.certificate_id = certificate.id
-        self.value_of_workdone_incl_vat = certificate.current_claim_excl_vat + certificate.vat_value
-        self.total_value_of_workdone_excl_vat = certificate.current_claim_excl_vat
-        self.retention = certificate.current_claim_excl_vat * Decimal('0.10')
-        self.total_amount_payable = certificate.current_claim_excl_vat + certificate.vat_value - self.retention
+        values = money.calculation_values(certificate.current_claim_excl_vat, MOCK_VAT_RATE, MOCK_RETENTION_RATE)
+        self.value_of_workdone_incl_vat = values['value_of_workdone_incl_vat']
+        self.total_value_of_workdone_excl_vat = values['total_value_of_workdone_excl_vat']
+        self.retention = values['retention']
+        self.total_amount_payable = values['total_amount_payable']
 
 
 # Mock data storage
@@ -1,8 +1,68 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, NullIf
 from django.contrib.auth.models import User
 from decimal import Decimal
 from django.core.validators import MinValueValidator
 from django.urls import reverse
+from django.utils import timezone
+from .settings_cache import get_system_settings
+from . import money
+
+DEFAULT_VAT_RATE = Decimal('15.00')
+DEFAULT_RETENTION_RATE = Decimal('10.00')
+
+
+# Certificate values held in Calculations, whether stored or computed on read
+CALCULATION_FIELDS = ['value_of_workdone_incl_vat', 'total_value_of_workdone_excl_vat', 'retention', 'total_amount_payable']
+
+
+def get_calculation_rates():
+    """Current (vat_rate, retention_rate) percentages from SystemSettings"""
+    system_settings = get_system_settings()
+    return system_settings.vat_rate, system_settings.retention_rate
+
+
+def calculations_stored():
+    """
+    True unless settings.CALCULATIONS_MODE is 'computed', in which case no
+    Calculations rows are written and the values are derived on read.
+    """
+    return getattr(settings, 'CALCULATIONS_MODE', 'stored') != 'computed'
+
+
+def calculation_factors(vat_rate, retention_rate):
+    """What current_claim_excl_vat is multiplied by to give each Calculations field"""
+    return {
+        'value_of_workdone_incl_vat': (100 + vat_rate) / 100,
+        'total_value_of_workdone_excl_vat': Decimal(1),
+        'retention': retention_rate / 100,
+        'total_amount_payable': (100 + vat_rate - retention_rate) / 100,
+    }
+
+
+class ProjectQuerySet(models.QuerySet):
+    def with_summary(self):
+        """
+        Annotate the figures shown on project cards, in the same query:
+        certificate_total, claimed_total, remaining_total, percent_certified
+        (of tender_sum) and latest_certificate_at. Totals come from the
+        ledger; the latest date is one index lookup on (project, -created_at).
+        """
+        money_field = models.DecimalField(max_digits=14, decimal_places=2)
+        claimed = Coalesce(models.F('ledger__claimed_to_date'), models.Value(Decimal('0.00')), output_field=money_field)
+        return self.annotate(
+            certificate_total=Coalesce(models.F('ledger__certificate_count'), models.Value(0)),
+            claimed_total=claimed,
+            remaining_total=models.ExpressionWrapper(models.F('tender_sum') - claimed, output_field=money_field),
+            percent_certified=models.ExpressionWrapper(
+                claimed * 100 / NullIf(models.F('tender_sum'), 0),
+                output_field=models.DecimalField(max_digits=9, decimal_places=2)
+            ),
+            latest_certificate_at=models.Subquery(
+                Certificate.objects.filter(project=models.OuterRef('pk')).order_by('-created_at').values('created_at')[:1]
+            ),
+        )
 
 
 class Project(models.Model):
@@ -18,6 +78,8 @@ class Project(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProjectQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.name_of_contractor} - {self.contract_no}"
 
@@ -29,9 +91,78 @@ class Project(models.Model):
         indexes = [
             models.Index(fields=['owner', '-created_at']),
             models.Index(fields=['contract_no']),
+            # Delta exports read the rows changed since a watermark
+            models.Index(fields=['updated_at', 'id']),
         ]
 
 
+class CertificateQuerySet(models.QuerySet):
+    def with_calculations(self):
+        """
+        Annotate each certificate with its Calculations values as calc_<field>.
+
+        In stored mode they come from the Calculations table through a join;
+        in computed mode they are expressions over current_claim_excl_vat at
+        the current rates. Read them with Certificate.get_calculations().
+        """
+        if calculations_stored():
+            return self.annotate(**{
+                f'calc_{field}': models.F(f'calculations__{field}') for field in CALCULATION_FIELDS
+            })
+
+        # Extra places keep the exact product; get_calculations() rounds it to cents
+        # with money.round_decimal
+        output_field = models.DecimalField(max_digits=18, decimal_places=6)
+        factors = calculation_factors(*get_calculation_rates())
+        return self.annotate(**{
+            f'calc_{field}': models.ExpressionWrapper(
+                models.F('current_claim_excl_vat') * models.Value(factors[field]),
+                output_field=output_field
+            )
+            for field in CALCULATION_FIELDS
+        })
+
+
+class CertificateManager(models.Manager.from_queryset(CertificateQuerySet)):
+    def bulk_create_with_calculations(self, certificates, batch_size=500):
+        """
+        Insert unsaved certificates and their Calculations with two bulk
+        INSERTs instead of the three or more queries save() costs per row.
+        Certificates must already have their project set.
+        """
+        vat_rate, retention_rate = get_calculation_rates()
+        for certificate in certificates:
+            certificate.vat_value = certificate._calculate_vat(vat_rate)
+
+        from .ledger import apply_delta, rebuild_ledgers
+        from .stats import record_rows
+        with transaction.atomic(using=self.db):
+            created = self.bulk_create(certificates, batch_size=batch_size)
+            # bulk_create skips the signals that keep the statistics page counters
+            record_rows('certificate_count', [certificate.created_at for certificate in created])
+            if not calculations_stored():
+                # Nothing else to write; bulk_create skips signals, so recount the ledgers
+                rebuild_ledgers(Project.objects.filter(pk__in={c.project_id for c in created}))
+                return created
+
+            calculations = Calculations.objects.using(self.db).bulk_create(
+                [Calculations(certificate=certificate, **certificate._calculate_values(vat_rate, retention_rate))
+                 for certificate in created],
+                batch_size=batch_size
+            )
+
+            # bulk_create skips signals, so fold the batch into the ledgers here
+            deltas = {}
+            for calc in calculations:
+                count, amounts = deltas.get(calc.certificate.project_id, (0, [0] * len(Calculations.LEDGER_FIELDS)))
+                deltas[calc.certificate.project_id] = (
+                    count + 1, [total + value for total, value in zip(amounts, calc.ledger_values())]
+                )
+            for project_id, (count, amounts) in deltas.items():
+                apply_delta(project_id, count, amounts)
+        return created
+
+
 class Certificate(models.Model):
     CURRENCY_CHOICES = [
         ('USD', 'USD'),
@@ -57,33 +188,62 @@ class Certificate(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CertificateManager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # In computed mode the ledger signals apply a delta from the claim that was stored
+        if 'project_id' in field_names and 'current_claim_excl_vat' in field_names:
+            instance._ledger_snapshot = (instance.project_id, instance.current_claim_excl_vat)
+        return instance
+
     def save(self, *args, **kwargs):
-        # Auto-calculate VAT (15% of current claim)
-        self.vat_value = self.current_claim_excl_vat * Decimal('0.15')
+        # Auto-calculate VAT at the configured rate (15% by default)
+        vat_rate, retention_rate = get_calculation_rates()
+        self.vat_value = self._calculate_vat(vat_rate)
         super().save(*args, **kwargs)
+        if not calculations_stored():
+            return
 
         # Create or update calculations
+        values = self._calculate_values(vat_rate, retention_rate)
         calculations, created = Calculations.objects.get_or_create(
             certificate=self,
-            defaults=self._calculate_values()
+            defaults=values
         )
         if not created:
-            for key, value in self._calculate_values().items():
+            for key, value in values.items():
                 setattr(calculations, key, value)
             calculations.save()
 
-    def _calculate_values(self):
-        retention = self.current_claim_excl_vat * Decimal('0.10')
-        value_of_workdone_incl_vat = self.current_claim_excl_vat + self.vat_value
-        total_value_of_workdone_excl_vat = self.current_claim_excl_vat
-        total_amount_payable = self.current_claim_excl_vat + self.vat_value - retention
+    def _calculate_vat(self, vat_rate=DEFAULT_VAT_RATE):
+        claim_cents = money.to_cents(self.current_claim_excl_vat)
+        return money.from_cents(money.percent_of(claim_cents, money.to_basis_points(vat_rate)))
+
+    def _calculate_values(self, vat_rate=DEFAULT_VAT_RATE, retention_rate=DEFAULT_RETENTION_RATE):
+        # Rounded here, half to even, exactly as the database would round the raw Decimals
+        return money.calculation_values(self.current_claim_excl_vat, vat_rate, retention_rate)
+
+    def get_calculations(self):
+        """
+        The certificate's Calculations, read the same way in both modes.
 
-        return {
-            'value_of_workdone_incl_vat': value_of_workdone_incl_vat,
-            'total_value_of_workdone_excl_vat': total_value_of_workdone_excl_vat,
-            'retention': retention,
-            'total_amount_payable': total_amount_payable,
-        }
+        Uses the with_calculations() annotations when the certificate was
+        loaded with them, otherwise the stored row or, in computed mode,
+        values worked out here. Computed instances are never saved. Raises
+        Calculations.DoesNotExist if a stored row is missing.
+        """
+        if hasattr(self, 'calc_retention'):
+            values = {field: getattr(self, f'calc_{field}') for field in CALCULATION_FIELDS}
+            if None in values.values():
+                raise Calculations.DoesNotExist(f'Certificate {self.pk} has no calculations')
+            return Calculations(certificate=self, **{
+                field: money.round_decimal(value) for field, value in values.items()
+            })
+        if calculations_stored():
+            return self.calculations
+        return Calculations(certificate=self, **self._calculate_values(*get_calculation_rates()))
 
     def __str__(self):
         return f"Certificate {self.id} - {self.project.name_of_contractor}"
@@ -98,6 +258,7 @@ class Certificate(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['project', '-created_at']),
+            models.Index(fields=['updated_at', 'id']),
         ]
 
 
@@ -108,8 +269,141 @@ class Calculations(models.Model):
     retention = models.DecimalField(max_digits=12, decimal_places=2)
     total_amount_payable = models.DecimalField(max_digits=12, decimal_places=2)
 
+    # Fields whose totals are mirrored in ProjectLedger
+    LEDGER_FIELDS = ['total_value_of_workdone_excl_vat', 'value_of_workdone_incl_vat', 'retention', 'total_amount_payable']
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was stored so ledger updates can apply a delta
+        if all(field in field_names for field in cls.LEDGER_FIELDS):
+            instance._ledger_snapshot = instance.ledger_values()
+        return instance
+
+    def ledger_values(self):
+        return [getattr(self, field) for field in self.LEDGER_FIELDS]
+
     def __str__(self):
         return f"Calculations for Certificate {self.certificate.id}"
 
     class Meta:
         verbose_name_plural = "Calculations"
+
+
+class PdfRenderJob(models.Model):
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+
+    certificate = models.ForeignKey(Certificate, on_delete=models.CASCADE, related_name='pdf_jobs')
+    requested_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pdf_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    pdf_file = models.FileField(upload_to='rendered_pdfs/', blank=True)
+    error = models.TextField(blank=True)
+    # Times a worker has claimed the job; a stale RUNNING job is retried until PDF_JOB_MAX_ATTEMPTS
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"PDF job {self.id} for Certificate {self.certificate_id} ({self.status})"
+
+    def get_absolute_url(self):
+        return reverse('pdf_job_status', kwargs={'pk': self.pk})
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+
+class RecalculationJob(models.Model):
+    """A queued recalculation of every certificate at new rates, resumable from last_pk"""
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+        ('SUPERSEDED', 'Superseded'),
+    ]
+
+    vat_rate = models.DecimalField(max_digits=5, decimal_places=2)
+    retention_rate = models.DecimalField(max_digits=5, decimal_places=2)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    # Highest certificate pk recalculated so far; a reclaimed job carries on after it
+    last_pk = models.BigIntegerField(default=0)
+    updated_count = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Moves with every batch, so a job whose worker died is told apart from a long one
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Recalculation {self.id} at VAT {self.vat_rate}% / retention {self.retention_rate}% ({self.status})"
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+
+class BulkCertificateRequest(models.Model):
+    """Stored result of a bulk certificate upload, replayed when a client retries with the same key"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bulk_certificate_requests')
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='bulk_certificate_requests')
+    idempotency_key = models.CharField(max_length=100)
+    # SHA-256 of the request body, so reusing the key for a different batch is refused
+    request_hash = models.CharField(max_length=64, blank=True, default='')
+    response = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Bulk upload {self.idempotency_key} by {self.user}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], name='unique_bulk_certificate_request_key'),
+        ]
+
+
+class ProjectLedger(models.Model):
+    """Running financial totals for a project, kept up to date as certificates change"""
+    project = models.OneToOneField(Project, on_delete=models.CASCADE, primary_key=True, related_name='ledger')
+    certificate_count = models.PositiveIntegerField(default=0)
+    claimed_to_date = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    value_incl_vat_to_date = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    retention_held = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_paid = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def remaining_tender_sum(self):
+        return self.project.tender_sum - self.claimed_to_date
+
+    def __str__(self):
+        return f"Ledger for {self.project}"
+
+
+class Tombstone(models.Model):
+    """A deleted project or certificate, reported by delta exports so copies of the data can drop it too"""
+    model_name = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    def __str__(self):
+        return f"{self.model_name} {self.object_id} deleted {self.deleted_at}"
+
+    class Meta:
+        ordering = ['deleted_at']
+        indexes = [
+            models.Index(fields=['deleted_at', 'id']),
+        ]
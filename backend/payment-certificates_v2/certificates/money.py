@@ -0,0 +1,141 @@
+"""
+Integer-cent arithmetic for certificate amounts.
+
+Amounts are carried as int cents and rates as int basis points (15.00% is
+1500). A cents x basis points product is exact in units of 1e-6, i.e.
+SCALE of them make one cent, so nothing is lost until the single rounding
+step at the end of each calculation.
+
+Rounding rules:
+
+HALF_EVEN (banker's rounding)
+    Ties go to the even cent: 0.125 -> 0.12, 0.135 -> 0.14. This is what the
+    database applies when Django saves an unrounded Decimal into a
+    DecimalField, so it is the default for every stored value.
+HALF_UP
+    Ties go away from zero: 0.125 -> 0.13, -0.125 -> -0.13. The usual
+    "schoolbook" rule, for figures that must match a hand calculation.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+HALF_EVEN = 'half_even'
+HALF_UP = 'half_up'
+
+# Units of 1e-6 (cents x basis points) per cent
+SCALE = 10000
+
+CertificateAmounts = namedtuple('CertificateAmounts', [
+    'vat',
+    'value_of_workdone_incl_vat',
+    'total_value_of_workdone_excl_vat',
+    'retention',
+    'total_amount_payable',
+])
+
+
+def to_cents(amount):
+    """Decimal (or int/str) amount -> int cents; anything past two places is rounded half to even"""
+    return int((Decimal(amount) * 100).to_integral_value())
+
+
+def to_basis_points(rate):
+    """Percentage rate -> int basis points (15.00 -> 1500)"""
+    return int((Decimal(rate) * 100).to_integral_value())
+
+
+def from_cents(cents):
+    """int cents -> Decimal with two places"""
+    return Decimal(cents).scaleb(-2)
+
+
+def round_scaled(value, rounding=HALF_EVEN):
+    """Round an int in units of 1e-6 to whole cents"""
+    if rounding == HALF_UP:
+        cents, remainder = divmod(abs(value), SCALE)
+        if remainder * 2 >= SCALE:
+            cents += 1
+        return cents if value >= 0 else -cents
+    if rounding != HALF_EVEN:
+        raise ValueError(f'Unknown rounding rule: {rounding}')
+
+    # divmod floors, so the remainder is never negative
+    cents, remainder = divmod(value, SCALE)
+    doubled = remainder * 2
+    if doubled > SCALE or (doubled == SCALE and cents % 2):
+        cents += 1
+    return cents
+
+
+def round_decimal(value, rounding=HALF_EVEN):
+    """
+    Round a Decimal (or float) to cents. The value is first snapped to the
+    1e-6 grid, which absorbs float noise from databases without exact
+    decimals (SQLite) before the tie-breaking rule sees it.
+    """
+    scaled = int(Decimal(value).scaleb(6).to_integral_value())
+    return from_cents(round_scaled(scaled, rounding))
+
+
+def percent_of(cents, basis_points, rounding=HALF_EVEN):
+    """basis_points of an amount in cents, rounded to cents"""
+    return round_scaled(cents * basis_points, rounding)
+
+
+def calculate(claim_cents, vat_bp, retention_bp, rounding=HALF_EVEN):
+    """
+    Every certificate figure for a claim, in cents. Each one is rounded once
+    from the exact value, so value_of_workdone_incl_vat is not necessarily
+    claim + vat when vat itself was a tie.
+    """
+    claim_scaled = claim_cents * SCALE
+    vat_scaled = claim_cents * vat_bp
+    retention_scaled = claim_cents * retention_bp
+    return CertificateAmounts(
+        vat=round_scaled(vat_scaled, rounding),
+        value_of_workdone_incl_vat=round_scaled(claim_scaled + vat_scaled, rounding),
+        total_value_of_workdone_excl_vat=claim_cents,
+        retention=round_scaled(retention_scaled, rounding),
+        total_amount_payable=round_scaled(claim_scaled + vat_scaled - retention_scaled, rounding),
+    )
+
+
+def _percent_column(claims_cents, basis_points, rounding):
+    """percent_of() for a list of amounts, with the half-to-even case inlined for speed"""
+    if rounding != HALF_EVEN:
+        return [round_scaled(claim_cents * basis_points, rounding) for claim_cents in claims_cents]
+
+    half = SCALE // 2
+    column = []
+    append = column.append
+    for claim_cents in claims_cents:
+        # Adding half and flooring rounds ties up; an odd result on a tie steps back to even
+        scaled = claim_cents * basis_points + half
+        cents = scaled // SCALE
+        if cents & 1 and not scaled % SCALE:
+            cents -= 1
+        append(cents)
+    return column
+
+
+def calculate_many(claims_cents, vat_bp, retention_bp, rounding=HALF_EVEN):
+    """
+    calculate() for a batch of claims. Returns CertificateAmounts of lists,
+    one per field, in the order of claims_cents. Building four flat columns
+    of ints instead of a tuple per row is what makes this several times
+    faster than Decimal arithmetic in bulk.
+    """
+    claims_cents = list(claims_cents)
+    return CertificateAmounts(
+        vat=_percent_column(claims_cents, vat_bp, rounding),
+        value_of_workdone_incl_vat=_percent_column(claims_cents, SCALE + vat_bp, rounding),
+        total_value_of_workdone_excl_vat=claims_cents,
+        retention=_percent_column(claims_cents, retention_bp, rounding),
+        total_amount_payable=_percent_column(claims_cents, SCALE + vat_bp - retention_bp, rounding),
+    )
+
+
+def calculation_values(claim, vat_rate, retention_rate, rounding=HALF_EVEN):
+    """Calculations field values for a Decimal claim at percentage rates, as Decimals"""
+    amounts = calculate(to_cents(claim), to_basis_points(vat_rate), to_basis_points(retention_rate), rounding)
+    return {field: from_cents(cents) for field, cents in amounts._asdict().items() if field != 'vat'}
@@ -0,0 +1,162 @@
+"""
+Keyset (cursor) pagination for list views over large, append-mostly tables.
+
+Instead of OFFSET, each page remembers the sort key of its first and last
+rows in a signed, opaque token, and the next page is fetched with a WHERE on
+that key. With an index on the ordering columns page 5,000 costs the same as
+page 1, and no page needs a COUNT(*). An approximate total is available on
+request.
+"""
+import json
+from django.core import signing
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+TOKEN_SALT = 'certificates.pagination'
+
+# Without a planner estimate the total is counted up to this many rows
+APPROXIMATE_COUNT_LIMIT = 10000
+
+
+def _field_name(ordering):
+    return ordering.lstrip('-')
+
+
+def encode_token(obj, ordering):
+    values = []
+    for field in ordering:
+        value = getattr(obj, _field_name(field))
+        values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+    return signing.dumps(values, salt=TOKEN_SALT, compress=True)
+
+
+def decode_token(token, ordering):
+    """Sort-key values from a token, or None if it is missing or has been tampered with"""
+    if not token:
+        return None
+    try:
+        values = signing.loads(token, salt=TOKEN_SALT)
+    except signing.BadSignature:
+        return None
+    if not isinstance(values, list) or len(values) != len(ordering):
+        return None
+    decoded = []
+    for value in values:
+        # Datetimes travel as ISO strings
+        parsed = parse_datetime(value) if isinstance(value, str) else None
+        decoded.append(value if parsed is None else parsed)
+    return decoded
+
+
+def _after(ordering, values, reverse=False):
+    """Q matching rows strictly after values in ordering (or before, if reverse)"""
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        descending = field.startswith('-') != reverse
+        lookup = 'lt' if descending else 'gt'
+        name = _field_name(field)
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def _reversed(ordering):
+    return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+
+class KeysetPage:
+    def __init__(self, object_list, ordering, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+        self.next_token = encode_token(object_list[-1], ordering) if has_next else ''
+        self.previous_token = encode_token(object_list[0], ordering) if has_previous else ''
+        self.approximate_total = None
+        self.total_is_exact = False
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def paginate(queryset, ordering, per_page, after=None, before=None):
+    """
+    One page of queryset in ordering, which must end in a unique field
+    (e.g. ['-created_at', '-pk']). after/before are tokens from a previous
+    page; bad tokens are treated as no token.
+    """
+    after_values = decode_token(after, ordering)
+    before_values = decode_token(before, ordering) if after_values is None else None
+
+    if before_values is not None:
+        # Walk backwards from the token, then put the page back in display order
+        rows = list(queryset.filter(_after(ordering, before_values, reverse=True))
+                    .order_by(*_reversed(ordering))[:per_page + 1])
+        has_previous = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        return KeysetPage(rows, ordering, has_next=bool(rows), has_previous=has_previous)
+
+    if after_values is not None:
+        queryset = queryset.filter(_after(ordering, after_values))
+    rows = list(queryset.order_by(*ordering)[:per_page + 1])
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    return KeysetPage(rows, ordering, has_next=has_next, has_previous=after_values is not None and bool(rows))
+
+
+def approximate_count(queryset):
+    """
+    Cheap row count for display. PostgreSQL uses the planner's estimate for
+    the query; elsewhere rows are counted up to APPROXIMATE_COUNT_LIMIT.
+    Returns (count, exact).
+    """
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.order_by().values('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows']), False
+
+    count = queryset.order_by()[:APPROXIMATE_COUNT_LIMIT + 1].count()
+    if count > APPROXIMATE_COUNT_LIMIT:
+        return APPROXIMATE_COUNT_LIMIT, False
+    return count, True
+
+
+class KeysetPaginationMixin:
+    """
+    ListView mixin replacing OFFSET pagination with keyset pagination.
+
+    Set keyset_ordering and paginate_by. Templates get page_obj with
+    has_next/has_previous and next_token/previous_token for ?after= and
+    ?before= links; ?total=1 also fills page_obj.approximate_total and
+    page_obj.total_is_exact.
+    """
+    keyset_ordering = ['-pk']
+
+    def paginate_queryset(self, queryset, page_size):
+        page = paginate(
+            queryset,
+            self.keyset_ordering,
+            page_size,
+            after=self.request.GET.get('after'),
+            before=self.request.GET.get('before'),
+        )
+        if self.request.GET.get('total'):
+            page.approximate_total, page.total_is_exact = approximate_count(queryset)
+        return None, page, page.object_list, page.has_other_pages()
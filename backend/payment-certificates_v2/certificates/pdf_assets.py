@@ -0,0 +1,107 @@
+"""
+Per-process registry of decoded PDF assets.
+
+The company logo is decoded, downsampled and wrapped in an ImageReader once
+and reused for every render until the SystemSettings row changes. TTF fonts
+listed in settings.PDF_FONTS are registered with ReportLab once per process.
+"""
+import logging
+import threading
+from django.conf import settings
+from PIL import Image as PILImage
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Flowable
+
+logger = logging.getLogger(__name__)
+
+# Logos are drawn at most this size, so there is no point keeping more pixels
+LOGO_MAX_PIXELS = 600
+LOGO_MAX_HEIGHT = 0.8 * inch
+LOGO_MAX_WIDTH = 2.5 * inch
+
+_lock = threading.Lock()
+_logo_key = None
+_logo = None
+_fonts_registered = False
+
+
+class LogoFlowable(Flowable):
+    """Draws a cached ImageReader without re-decoding it"""
+
+    def __init__(self, reader):
+        super().__init__()
+        self.reader = reader
+        width, height = reader.getSize()
+        scale = min(LOGO_MAX_WIDTH / width, LOGO_MAX_HEIGHT / height, 1)
+        self.width = width * scale
+        self.height = height * scale
+        self.hAlign = 'LEFT'
+
+    def wrap(self, available_width, available_height):
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.drawImage(self.reader, 0, 0, self.width, self.height, mask='auto')
+
+
+def _load_logo(field_file):
+    with field_file.open('rb') as f:
+        image = PILImage.open(f)
+        image.load()
+    image.thumbnail((LOGO_MAX_PIXELS, LOGO_MAX_PIXELS))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    reader = ImageReader(image)
+    # Decode to raw RGB now so no render pays for it
+    reader.getRGBData()
+    return reader
+
+
+def get_logo(system_settings):
+    """Return the cached logo ImageReader, or None if no logo should be drawn"""
+    global _logo_key, _logo
+    if system_settings is None or not system_settings.include_company_logo_in_pdf:
+        return None
+    if not system_settings.company_logo:
+        return None
+
+    key = (system_settings.updated_at, system_settings.company_logo.name)
+    if key == _logo_key:
+        return _logo
+
+    with _lock:
+        if key != _logo_key:
+            try:
+                _logo = _load_logo(system_settings.company_logo)
+            except Exception as e:
+                # Cache the failure too so a broken upload is not retried on every render
+                logger.warning(f'Could not load company logo for PDFs: {str(e)}')
+                _logo = None
+            _logo_key = key
+        return _logo
+
+
+def register_fonts():
+    """Register the TTF fonts from settings.PDF_FONTS ({name: path}) once per process"""
+    global _fonts_registered
+    if _fonts_registered:
+        return
+    with _lock:
+        if _fonts_registered:
+            return
+        for name, path in getattr(settings, 'PDF_FONTS', {}).items():
+            try:
+                pdfmetrics.registerFont(TTFont(name, path))
+            except Exception as e:
+                logger.warning(f'Could not register PDF font {name} from {path}: {str(e)}')
+        _fonts_registered = True
+
+
+def invalidate():
+    global _logo_key, _logo
+    with _lock:
+        _logo_key = None
+        _logo = None
@@ -0,0 +1,222 @@
+"""
+On-disk, content-addressed cache for rendered certificate PDFs.
+
+Entries are keyed by a hash of every input that affects the rendered
+document, so a changed certificate, calculation, project or PDF setting
+simply produces a new key. Old entries are evicted least-recently-used
+first once the cache grows past PDF_CACHE_MAX_BYTES, down to EVICT_TO of
+the cap so the next few writes don't trigger another eviction.
+
+Each process keeps a running count of the cache's size, adjusted as it
+stores and evicts entries, so a write never lists the directory. Other
+workers write to the same directory, so the count is refreshed by a scan
+at most every PDF_CACHE_RESCAN_SECONDS; until then it can run behind by
+whatever they wrote in the meantime.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from django.conf import settings
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_RESCAN_SECONDS = 60
+# Fraction of the cap an eviction trims the cache down to
+EVICT_TO = 0.9
+
+# Settings fields that end up on the rendered PDF
+SETTINGS_FIELDS = [
+    'pdf_header_text',
+    'pdf_footer_text',
+    'approval_title_1',
+    'approval_title_2',
+    'include_company_logo_in_pdf',
+    'company_logo',
+    'vat_rate',
+    'retention_rate',
+]
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+# cache directory -> {'bytes', 'entries', 'scanned_at'}
+_usage = {}
+
+
+def get_cache_dir():
+    return Path(getattr(settings, 'PDF_CACHE_DIR', settings.BASE_DIR / 'cache' / 'pdf'))
+
+
+def get_max_bytes():
+    return getattr(settings, 'PDF_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+
+
+def make_key(project, certificate, calculations, system_settings=None, render_date=''):
+    """Hash every value that is rendered into the certificate PDF"""
+    parts = [
+        certificate.pk,
+        certificate.currency,
+        certificate.current_claim_excl_vat,
+        certificate.vat_value,
+        certificate.previous_payment_excl_vat,
+        project.name_of_contractor,
+        project.contract_no,
+        project.vote_no,
+        project.tender_sum,
+        calculations.value_of_workdone_incl_vat,
+        calculations.total_value_of_workdone_excl_vat,
+        calculations.retention,
+        calculations.total_amount_payable,
+        render_date,
+    ]
+    if system_settings is not None:
+        parts.extend(getattr(system_settings, field) for field in SETTINGS_FIELDS)
+
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\x1f')
+    return digest.hexdigest()
+
+
+def _path_for(key):
+    return get_cache_dir() / key[:2] / f'{key}.pdf'
+
+
+def load(key):
+    """Return cached PDF bytes for key, or None on a miss"""
+    path = _path_for(key)
+    try:
+        data = path.read_bytes()
+    except OSError:
+        with _lock:
+            _stats['misses'] += 1
+        return None
+
+    # Bump the mtime so eviction treats this entry as recently used
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    with _lock:
+        _stats['hits'] += 1
+    return data
+
+
+def store(key, data):
+    """Store PDF bytes under key and evict old entries if over the size cap"""
+    path = _path_for(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Before the write, so a rescan doesn't count the new file on top of the delta below
+    usage = _current_usage()
+    try:
+        replaced = path.stat().st_size
+    except OSError:
+        replaced = None
+
+    # Write to a temp file first so readers never see a partial PDF
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    with _lock:
+        usage['bytes'] += len(data) - (replaced or 0)
+        usage['entries'] += 0 if replaced is not None else 1
+    if usage['bytes'] > get_max_bytes():
+        _evict(keep=str(path))
+
+
+def _entries():
+    cache_dir = get_cache_dir()
+    if not cache_dir.exists():
+        return []
+    entries = []
+    for shard in os.scandir(cache_dir):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if entry.name.endswith('.pdf'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+
+def _rescan():
+    """Count the cache directory again; returns its entries"""
+    entries = _entries()
+    with _lock:
+        _usage[get_cache_dir()] = {
+            'bytes': sum(size for _, size, _ in entries),
+            'entries': len(entries),
+            'scanned_at': time.monotonic(),
+        }
+    return entries
+
+
+def _current_usage():
+    """The running size count for the cache directory, rescanned when it is stale"""
+    rescan = getattr(settings, 'PDF_CACHE_RESCAN_SECONDS', DEFAULT_RESCAN_SECONDS)
+    usage = _usage.get(get_cache_dir())
+    if usage is None or time.monotonic() - usage['scanned_at'] >= rescan:
+        _rescan()
+        usage = _usage[get_cache_dir()]
+    return usage
+
+
+def _evict(keep=None):
+    # Only over the cap: a full listing, which also corrects the running count
+    entries = _rescan()
+    usage = _usage[get_cache_dir()]
+    if usage['bytes'] <= get_max_bytes():
+        return
+    target = get_max_bytes() * EVICT_TO
+
+    # Oldest access first
+    entries.sort()
+    for _, size, entry_path in entries:
+        if usage['bytes'] <= target:
+            break
+        if entry_path == keep:
+            # The entry that was just written stays, even if it alone exceeds the target
+            continue
+        try:
+            os.remove(entry_path)
+        except OSError:
+            continue
+        with _lock:
+            usage['bytes'] -= size
+            usage['entries'] -= 1
+            _stats['evictions'] += 1
+
+
+def clear():
+    """Remove every cached PDF"""
+    for _, _, entry_path in _entries():
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+    _rescan()
+
+
+def stats():
+    """Hit/miss counters for this process plus the on-disk footprint, from the running count"""
+    usage = _current_usage()
+    with _lock:
+        result = dict(_stats)
+        result['entries'] = usage['entries']
+        result['bytes'] = usage['bytes']
+    return result
+
+
+def reset_stats():
+    with _lock:
+        for name in _stats:
+            _stats[name] = 0
@@ -0,0 +1,108 @@
+"""
+Concatenation of ReportLab-generated PDFs into one file, streamed.
+
+ReportLab's canvas holds every page until save(), so one canvas for a whole
+print pack grows with the pack. write_print_pack() instead renders a few
+certificates at a time into a small buffer and appends each finished PDF
+here. Its objects are renumbered after the ones already written and copied
+straight to the output, and its pages are hung off a single page tree
+written at the end. All that is kept per page is its object number and one
+8-byte offset per object for the cross-reference table.
+
+Only the structure ReportLab itself writes is understood: one
+cross-reference section, a catalog pointing at a flat page tree, and
+indirect references of the form "N 0 R". Stream data is copied unchanged.
+"""
+import re
+from array import array
+
+REFERENCE = re.compile(rb'(\d+) 0 R\b')
+
+
+class PdfConcatenator:
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.position = 0
+        # offsets[n - 1] is where object n starts; catalog and page tree are written last
+        self.offsets = array('Q', [0, 0])
+        self.pages = array('Q')
+        self._write(b'%PDF-1.4\n%\x93\x8c\x8b\x9e\n')
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.position += len(data)
+
+    def _start_object(self, number):
+        self.offsets[number - 1] = self.position
+
+    def append(self, pdf):
+        """Copy the pages of a ReportLab PDF (bytes) onto the end of the output"""
+        objects = _read_objects(pdf)
+        trailer = pdf[pdf.rindex(b'trailer'):]
+        root = int(re.search(rb'/Root (\d+) 0 R', trailer).group(1))
+        info = re.search(rb'/Info (\d+) 0 R', trailer)
+        pages = int(re.search(rb'/Pages (\d+) 0 R', objects[root]).group(1))
+        kids = [int(number) for number in REFERENCE.findall(re.search(rb'/Kids \[([^\]]*)\]', objects[pages]).group(1))]
+
+        # The batch's catalog, page tree and info are replaced by ours; the rest move up by base
+        skipped = {root, pages, int(info.group(1)) if info else None}
+        base = len(self.offsets) + 1
+        renumber = {number: base + index for index, number in enumerate(n for n in sorted(objects) if n not in skipped)}
+        renumber[pages] = self.PAGES
+
+        def rewrite(match):
+            return b'%d 0 R' % renumber[int(match.group(1))]
+
+        for number, body in sorted(objects.items()):
+            if number in skipped:
+                continue
+            # References only occur in the dictionary, never in the stream data after it
+            split = body.find(b'stream')
+            head, stream = (body, b'') if split < 0 else (body[:split], body[split:])
+            self.offsets.append(0)
+            self._start_object(renumber[number])
+            self._write(b'%d 0 obj\n' % renumber[number] + REFERENCE.sub(rewrite, head) + stream + b'endobj\n')
+        self.pages.extend(renumber[kid] for kid in kids)
+
+    def close(self):
+        """Write the page tree, catalog, cross-reference table and trailer"""
+        self._start_object(self.PAGES)
+        self._write(b'%d 0 obj\n<< /Type /Pages /Count %d /Kids [' % (self.PAGES, len(self.pages)))
+        for start in range(0, len(self.pages), 1000):
+            self._write(b''.join(b' %d 0 R' % page for page in self.pages[start:start + 1000]))
+        self._write(b' ] >>\nendobj\n')
+        self._start_object(self.CATALOG)
+        self._write(b'%d 0 obj\n<< /Type /Catalog /Pages %d 0 R >>\nendobj\n' % (self.CATALOG, self.PAGES))
+
+        xref = self.position
+        size = len(self.offsets) + 1
+        self._write(b'xref\n0 %d\n0000000000 65535 f \n' % size)
+        for start in range(0, len(self.offsets), 1000):
+            self._write(b''.join(b'%010d 00000 n \n' % offset for offset in self.offsets[start:start + 1000]))
+        self._write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size, self.CATALOG, xref))
+
+
+def _read_objects(pdf):
+    """{object number: body between 'N 0 obj' and 'endobj'} from the cross-reference table"""
+    xref = int(pdf[pdf.rindex(b'startxref') + len(b'startxref'):].split()[0])
+    lines = pdf[xref:pdf.index(b'trailer', xref)].split(b'\n')
+    first, count = (int(value) for value in lines[1].split())
+    offsets = {}
+    for number, line in enumerate(lines[2:2 + count], start=first):
+        offset, _, kind = line.split()[:3]
+        if kind == b'n':
+            offsets[number] = int(offset)
+
+    objects = {}
+    for number, offset in offsets.items():
+        start = pdf.index(b'obj', offset) + len(b'obj')
+        end = pdf.index(b'endobj', start)
+        stream = pdf.find(b'stream', start, end)
+        if stream >= 0:
+            # Look for endobj only after the stream data
+            end = pdf.index(b'endobj', pdf.index(b'endstream', stream))
+        objects[number] = pdf[start:end].lstrip(b'\r\n')
+    return objects
@@ -0,0 +1,148 @@
+"""
+Rendering certificate PDFs outside the request cycle.
+
+Web requests enqueue a PdfRenderJob; the process_pdf_jobs management command
+drains the queue and stores the finished file under MEDIA_ROOT.
+
+A job left RUNNING for longer than PDF_JOB_TIMEOUT_SECONDS belonged to a
+worker that died mid-render; the next process_pending() puts it back in the
+queue, or fails it once it has been tried PDF_JOB_MAX_ATTEMPTS times (see
+job_queue.py, shared with recalculation jobs). Finished jobs and their
+files are deleted PDF_JOB_RETENTION_DAYS after they finish by
+purge_finished_jobs(), which the worker runs periodically.
+
+Newly created certificates can also be pre-rendered into the PDF cache by a
+small in-process thread pool, so the first download is a cache hit.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.utils import timezone
+from .job_queue import JobQueue
+from .models import Certificate, PdfRenderJob
+from .settings_cache import get_system_settings
+from .utils import get_certificate_pdf_bytes
+
+logger = logging.getLogger(__name__)
+
+PURGE_BATCH_SIZE = 500
+
+queue = JobQueue(
+    PdfRenderJob, 'PDF job', 'PDF_JOB_TIMEOUT_SECONDS', 'PDF_JOB_MAX_ATTEMPTS', logger,
+    select_related=('certificate__project', 'certificate__calculations'),
+)
+
+
+def enqueue(certificate, user):
+    """Queue a render for certificate, reusing an unfinished job if one exists"""
+    job = PdfRenderJob.objects.filter(
+        certificate=certificate,
+        requested_by=user,
+        status__in=['PENDING', 'RUNNING']
+    ).first()
+    if job is None:
+        job = PdfRenderJob.objects.create(certificate=certificate, requested_by=user)
+    return job
+
+
+def claim_next_job():
+    """The oldest pending job, now RUNNING"""
+    return queue.claim_next()
+
+
+def process_job(job):
+    certificate = job.certificate
+    try:
+        pdf = get_certificate_pdf_bytes(certificate.project, certificate, certificate.get_calculations())
+        job.pdf_file.save(f'certificate_{certificate.id}_{job.id}.pdf', ContentFile(pdf), save=False)
+        job.status = 'DONE'
+        job.error = ''
+    except Exception as e:
+        logger.error(f'PDF job {job.id} failed: {str(e)}')
+        job.status = 'FAILED'
+        job.error = str(e)
+    job.finished_at = timezone.now()
+    job.save(update_fields=['pdf_file', 'status', 'error', 'finished_at'])
+    return job
+
+
+def process_pending(limit=None):
+    """Process queued jobs until the queue is empty or limit is reached"""
+    return queue.process_pending(process_job, limit)
+
+
+def purge_finished_jobs(days=None):
+    """Delete jobs that finished more than days ago (PDF_JOB_RETENTION_DAYS) and their files"""
+    if days is None:
+        days = getattr(settings, 'PDF_JOB_RETENTION_DAYS', 7)
+    finished = PdfRenderJob.objects.filter(
+        status__in=['DONE', 'FAILED'], finished_at__lt=timezone.now() - timedelta(days=days)
+    )
+    storage = PdfRenderJob._meta.get_field('pdf_file').storage
+    purged = 0
+    while True:
+        batch = list(finished.order_by('pk').values_list('pk', 'pdf_file')[:PURGE_BATCH_SIZE])
+        if not batch:
+            return purged
+        for _, name in batch:
+            if name:
+                storage.delete(name)
+        purged += PdfRenderJob.objects.filter(pk__in=[pk for pk, _ in batch]).delete()[0]
+
+
+_prerender_lock = threading.Lock()
+_prerender_executor = None
+_prerender_slots = None
+
+
+def _get_prerender_executor():
+    global _prerender_executor, _prerender_slots
+    with _prerender_lock:
+        if _prerender_executor is None:
+            workers = getattr(settings, 'PDF_PRERENDER_WORKERS', 2)
+            _prerender_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pdf-prerender')
+            # Cap queued + running renders so a burst of creations cannot pile up
+            _prerender_slots = threading.BoundedSemaphore(workers * getattr(settings, 'PDF_PRERENDER_QUEUE_FACTOR', 4))
+        return _prerender_executor, _prerender_slots
+
+
+def prerender_certificate(certificate_pk):
+    """Render a certificate into the PDF cache"""
+    try:
+        certificate = Certificate.objects.select_related('project').with_calculations().get(pk=certificate_pk)
+        get_certificate_pdf_bytes(certificate.project, certificate, certificate.get_calculations())
+    except Exception as e:
+        logger.error(f'PDF pre-render failed for certificate {certificate_pk}: {str(e)}')
+
+
+def _prerender_in_thread(certificate_pk, slots):
+    try:
+        prerender_certificate(certificate_pk)
+    finally:
+        # Each pool thread has its own connection; don't leave it open
+        connection.close()
+        slots.release()
+
+
+def schedule_prerender(certificate_pk):
+    """Pre-render a certificate once the current transaction commits, if enabled"""
+    if not get_system_settings().prerender_certificate_pdfs:
+        return
+
+    def submit():
+        # PDF_PRERENDER_WORKERS = 0 renders inline, which keeps tests deterministic
+        if getattr(settings, 'PDF_PRERENDER_WORKERS', 2) <= 0:
+            prerender_certificate(certificate_pk)
+            return
+        executor, slots = _get_prerender_executor()
+        if not slots.acquire(blocking=False):
+            logger.warning(f'PDF pre-render queue full, skipping certificate {certificate_pk}')
+            return
+        executor.submit(_prerender_in_thread, certificate_pk, slots)
+
+    # on_commit drops the callback if the transaction rolls back
+    transaction.on_commit(submit)
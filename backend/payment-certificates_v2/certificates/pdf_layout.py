@@ -0,0 +1,172 @@
+"""
+Precompiled ReportLab layout for payment certificate PDFs.
+
+Stylesheets, table styles and the static title, approval and footer blocks
+do not depend on the certificate, so they are built once per process and
+reused for every render. The layout is rebuilt whenever the PDF fields of
+SystemSettings change or a new company logo is decoded.
+"""
+import copy
+import threading
+from decimal import Decimal
+from xml.sax.saxutils import escape
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import Table, TableStyle, Paragraph, Spacer
+from . import pdf_assets
+
+# SystemSettings fields the layout is built from
+LAYOUT_FIELDS = [
+    'pdf_header_text', 'pdf_footer_text', 'approval_title_1', 'approval_title_2',
+    'vat_rate', 'retention_rate',
+]
+
+DEFAULTS = {
+    'pdf_header_text': "PAYMENT CERTIFICATE",
+    'pdf_footer_text': "This certificate is issued without prejudice to the rights and obligations of the parties under the Contract.",
+    'approval_title_1': "Project Manager",
+    'approval_title_2': "Finance Officer",
+    'vat_rate': Decimal('15.00'),
+    'retention_rate': Decimal('10.00'),
+}
+
+PROJECT_TABLE_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+])
+
+SUMMARY_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('ALIGN', (1, 1), (1, -1), 'RIGHT'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+APPROVAL_TABLE_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica-Bold'),
+])
+
+
+def format_rate(rate):
+    """15.00 -> '15', 12.50 -> '12.5'"""
+    return f'{rate:.2f}'.rstrip('0').rstrip('.')
+
+
+class CertificateLayout:
+    """Static parts of the certificate PDF, filled in per certificate by build_story"""
+
+    def __init__(self, pdf_header_text, pdf_footer_text, approval_title_1, approval_title_2,
+                 vat_rate=DEFAULTS['vat_rate'], retention_rate=DEFAULTS['retention_rate'], logo=None):
+        self.signature = (
+            pdf_header_text, pdf_footer_text, approval_title_1, approval_title_2,
+            vat_rate, retention_rate, logo,
+        )
+        self.logo = logo
+        self.vat_label = f'VAT ({format_rate(vat_rate)}%)'
+        self.retention_label = f'Retention ({format_rate(retention_rate)}%)'
+
+        styles = getSampleStyleSheet()
+        self.normal_style = styles['Normal']
+        heading_style = styles['Heading2']
+
+        self.title = Paragraph(escape(pdf_header_text), styles['Title'])
+        self.project_heading = Paragraph("Project Details", heading_style)
+        self.summary_heading = Paragraph("Certificate Summary", heading_style)
+        self.approval_heading = Paragraph("Approval", heading_style)
+        self.footer = Paragraph(escape(pdf_footer_text), self.normal_style)
+        self.approval_data = [
+            ['_' * 30, '_' * 30],
+            ['Authorized Signature', 'Authorized Signature'],
+            [approval_title_1, approval_title_2],
+        ]
+
+    def build_story(self, project, certificate, calculations, render_date):
+        """Return the list of flowables for one certificate"""
+        # Flowables record layout state on themselves when wrapped, so each
+        # render gets its own shallow copy of the prebuilt paragraphs
+        elements = []
+        if self.logo is not None:
+            elements.extend([pdf_assets.LogoFlowable(self.logo), Spacer(1, 6)])
+        elements += [
+            copy.copy(self.title),
+            Spacer(1, 12),
+            Paragraph(f"Certificate #{certificate.id}", self.normal_style),
+            Spacer(1, 12),
+            copy.copy(self.project_heading),
+            Spacer(1, 6),
+        ]
+
+        project_data = [
+            ['Contractor:', project.name_of_contractor],
+            ['Contract No:', project.contract_no],
+            ['Vote No:', project.vote_no],
+            ['Tender Sum:', f"{certificate.currency} {project.tender_sum:,.2f}"],
+            ['Currency:', certificate.currency],
+            ['Date:', render_date],
+        ]
+        project_table = Table(project_data, colWidths=[2*inch, 4*inch])
+        project_table.setStyle(PROJECT_TABLE_STYLE)
+        elements.extend([project_table, Spacer(1, 20)])
+
+        elements.extend([copy.copy(self.summary_heading), Spacer(1, 6)])
+        summary_data = [
+            ['Description', f'Amount ({certificate.currency})'],
+            ['Current Claim (Excl. VAT)', f'{certificate.current_claim_excl_vat:,.2f}'],
+            [self.vat_label, f'{certificate.vat_value:,.2f}'],
+            ['Previous Payment (Excl. VAT)', f'{certificate.previous_payment_excl_vat:,.2f}'],
+            ['Value of Work Done (Incl. VAT)', f'{calculations.value_of_workdone_incl_vat:,.2f}'],
+            ['Total Value of Work Done (Excl. VAT)', f'{calculations.total_value_of_workdone_excl_vat:,.2f}'],
+            [self.retention_label, f'{calculations.retention:,.2f}'],
+            ['Total Amount Payable', f'{calculations.total_amount_payable:,.2f}'],
+        ]
+        summary_table = Table(summary_data, colWidths=[4*inch, 2*inch])
+        summary_table.setStyle(SUMMARY_TABLE_STYLE)
+        elements.extend([summary_table, Spacer(1, 30)])
+
+        elements.extend([copy.copy(self.approval_heading), Spacer(1, 20)])
+        approval_table = Table(self.approval_data, colWidths=[3*inch, 3*inch])
+        approval_table.setStyle(APPROVAL_TABLE_STYLE)
+        elements.extend([approval_table, Spacer(1, 20)])
+
+        elements.append(copy.copy(self.footer))
+        return elements
+
+
+_lock = threading.Lock()
+_layout = None
+
+
+def get_layout(system_settings=None):
+    """Return the process-wide layout, rebuilding it if the PDF settings changed"""
+    global _layout
+    pdf_assets.register_fonts()
+    signature = tuple(
+        getattr(system_settings, field) if system_settings is not None else DEFAULTS[field]
+        for field in LAYOUT_FIELDS
+    ) + (pdf_assets.get_logo(system_settings),)
+    layout = _layout
+    if layout is not None and layout.signature == signature:
+        return layout
+
+    with _lock:
+        if _layout is None or _layout.signature != signature:
+            _layout = CertificateLayout(*signature)
+        return _layout
+
+
+def invalidate_layout():
+    global _layout
+    with _lock:
+        _layout = None
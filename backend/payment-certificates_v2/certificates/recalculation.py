@@ -0,0 +1,160 @@
+"""
+Batch recalculation of certificate VAT and Calculations after a rate change.
+
+Claims are read straight from values_list in primary-key order, the maths is
+done on integers and the results are written back with bulk_update, so
+recalculating hundreds of thousands of certificates never goes through
+Certificate.save() one row at a time.
+
+The arithmetic is the integer-cent code in money.py, the same code
+Certificate.save() uses, so a recalculated row is identical to a saved one.
+Each batch locks its certificates and reads their claims under the lock, so
+a certificate saved while a recalculation runs is never overwritten with
+amounts worked out from its old claim.
+
+A rate change in the settings page queues a RecalculationJob instead of
+working inside the web process. The process_recalculation_jobs command runs
+the queue one job at a time, recording the last certificate done after every
+batch. A job left RUNNING with no progress for RECALCULATION_JOB_TIMEOUT_SECONDS
+belonged to a worker that died; the next process_pending() puts it back in
+the queue to carry on where it stopped, or fails it once it has been tried
+RECALCULATION_JOB_MAX_ATTEMPTS times (see job_queue.py). Queuing a job
+supersedes any still waiting, since only the latest rates matter.
+"""
+import logging
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .job_queue import JobQueue
+from .ledger import rebuild_ledgers
+from .money import to_cents, to_basis_points, from_cents, calculate_many
+from .models import Certificate, Calculations, Project, RecalculationJob, get_calculation_rates, calculations_stored
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 2000
+
+queue = JobQueue(
+    RecalculationJob, 'recalculation job', 'RECALCULATION_JOB_TIMEOUT_SECONDS', 'RECALCULATION_JOB_MAX_ATTEMPTS',
+    logger, heartbeat_field='heartbeat_at', exclusive=True,
+)
+
+
+def recalculate_certificates(vat_rate=None, retention_rate=None, batch_size=DEFAULT_BATCH_SIZE, queryset=None,
+                             start_after=0, on_batch=None):
+    """
+    Recompute VAT and Calculations for every certificate in queryset after pk start_after; returns the
+    number updated. on_batch(last_pk, count) is called inside each batch's transaction.
+    """
+    if vat_rate is None or retention_rate is None:
+        current_vat, current_retention = get_calculation_rates()
+        vat_rate = current_vat if vat_rate is None else vat_rate
+        retention_rate = current_retention if retention_rate is None else retention_rate
+    vat_bp = to_basis_points(vat_rate)
+    retention_bp = to_basis_points(retention_rate)
+
+    if queryset is None:
+        queryset = Certificate.objects.all()
+    queryset = queryset.order_by('pk')
+    # Computed mode has no Calculations rows; only the stored VAT needs updating
+    stored = calculations_stored()
+
+    updated = 0
+    last_pk = start_after
+    while True:
+        # Keyset batches keep each query cheap however deep into the table we are
+        keys = list(queryset.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+        if not keys:
+            break
+        last_pk = keys[-1]
+
+        with transaction.atomic():
+            count = _recalculate_batch(queryset.filter(pk__in=keys), vat_bp, retention_bp, stored)
+            if on_batch is not None:
+                on_batch(last_pk, count)
+        updated += count
+
+    return updated
+
+
+def _recalculate_batch(batch, vat_bp, retention_bp, stored):
+    """Recalculate and write one batch of certificates inside the caller's transaction; returns the number updated"""
+    # Claims are read under the lock: a concurrent save either committed first and its claim is used
+    # here, or waits for this batch to commit and then writes its own figures
+    rows = list(batch.select_for_update(of=('self',)).values_list(
+        'pk', 'current_claim_excl_vat', 'calculations__pk' if stored else 'pk', 'project_id'
+    ))
+    if not rows:
+        return 0
+
+    now = timezone.now()
+    certificates = []
+    calculations = []
+    missing = []
+    project_ids = set()
+    amounts = calculate_many([to_cents(row[1]) for row in rows], vat_bp, retention_bp)
+    for i, (pk, claim, calculations_pk, project_id) in enumerate(rows):
+        project_ids.add(project_id)
+        certificates.append(Certificate(pk=pk, vat_value=from_cents(amounts.vat[i]), updated_at=now))
+        if not stored:
+            continue
+        values = Calculations(
+            pk=calculations_pk,
+            certificate_id=pk,
+            value_of_workdone_incl_vat=from_cents(amounts.value_of_workdone_incl_vat[i]),
+            total_value_of_workdone_excl_vat=from_cents(amounts.total_value_of_workdone_excl_vat[i]),
+            retention=from_cents(amounts.retention[i]),
+            total_amount_payable=from_cents(amounts.total_amount_payable[i]),
+        )
+        (calculations if calculations_pk else missing).append(values)
+
+    # updated_at moves too so PDF ETags and caches see the new figures
+    Certificate.objects.bulk_update(certificates, ['vat_value', 'updated_at'])
+    if calculations:
+        Calculations.objects.bulk_update(calculations, [
+            'value_of_workdone_incl_vat', 'total_value_of_workdone_excl_vat',
+            'retention', 'total_amount_payable',
+        ])
+    if missing:
+        Calculations.objects.bulk_create(missing)
+    # bulk writes bypass the ledger signals
+    rebuild_ledgers(Project.objects.filter(pk__in=project_ids))
+    return len(rows)
+
+
+def enqueue(vat_rate, retention_rate):
+    """Queue a recalculation at the given rates, superseding any job still waiting to start"""
+    RecalculationJob.objects.filter(status='PENDING').update(status='SUPERSEDED', finished_at=timezone.now())
+    return RecalculationJob.objects.create(vat_rate=vat_rate, retention_rate=retention_rate)
+
+
+def claim_next_job():
+    """The oldest pending job, now RUNNING, unless another job is already running"""
+    return queue.claim_next()
+
+
+def process_job(job):
+    """Recalculate every certificate at the job's rates, carrying on after job.last_pk"""
+    def progress(last_pk, count):
+        RecalculationJob.objects.filter(pk=job.pk).update(
+            last_pk=last_pk, updated_count=F('updated_count') + count, heartbeat_at=timezone.now()
+        )
+
+    try:
+        recalculate_certificates(job.vat_rate, job.retention_rate, start_after=job.last_pk, on_batch=progress)
+        job.status = 'DONE'
+        job.error = ''
+    except Exception as e:
+        logger.error(f'Recalculation job {job.id} failed: {str(e)}')
+        job.status = 'FAILED'
+        job.error = str(e)
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    job.refresh_from_db()
+    logger.info(f'Recalculation job {job.id} {job.status.lower()} after {job.updated_count} certificates')
+    return job
+
+
+def process_pending(limit=None):
+    """Run queued jobs until the queue is empty or limit is reached"""
+    return queue.process_pending(process_job, limit)
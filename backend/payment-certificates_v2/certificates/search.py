@@ -0,0 +1,173 @@
+"""
+Ranked project search over name_of_contractor, contract_no and vote_no.
+
+PostgreSQL uses pg_trgm GIN indexes on the three columns: rows are matched
+with the word-similarity operator, which the indexes serve, and ranked by
+the best similarity across the columns.
+
+SQLite uses an FTS5 table with the trigram tokenizer, kept in sync by the
+Project signal handlers. Every term is first matched as a substring, which
+covers prefixes; when that finds nothing, the query is retried as an OR of
+the terms' trigrams and the candidates are kept if they share enough of
+them, which tolerates typos.
+
+Other databases have neither index and get a plain case-insensitive
+substring match on the three columns, with no ranking or typo tolerance.
+
+Both indexes are created by migration 0007; rebuild_search_index refills the
+SQLite table after bulk loads, which skip the signals.
+"""
+from django.db import connection
+from django.db.models import Q
+from .models import Project
+
+FTS_TABLE = 'certificates_project_fts'
+SEARCH_FIELDS = ['name_of_contractor', 'contract_no', 'vote_no']
+
+# Share of the query's trigrams a row needs to count as a fuzzy match
+MIN_SIMILARITY = 0.4
+# Fuzzy matches are ranked by FTS5 first and only this many are checked
+FUZZY_CANDIDATES = 200
+
+def _terms(query):
+    # Split on whitespace only so codes such as RD-2024/001 stay one term
+    return query.lower().split()
+
+
+def _trigrams(text):
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _fts_string(value):
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _uses_fts():
+    return connection.vendor == 'sqlite'
+
+
+def index_project(project):
+    """Add or refresh a project in the SQLite search table"""
+    if not _uses_fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [project.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(SEARCH_FIELDS)}) VALUES (%s, %s, %s, %s)',
+            [project.pk] + [getattr(project, field) for field in SEARCH_FIELDS]
+        )
+
+
+def unindex_project(project_pk):
+    if not _uses_fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [project_pk])
+
+
+def rebuild_search_index():
+    """Refill the SQLite search table from the projects table; returns the number indexed"""
+    if not _uses_fts():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(SEARCH_FIELDS)}) '
+            f'SELECT id, {", ".join(SEARCH_FIELDS)} FROM {Project._meta.db_table}'
+        )
+        return cursor.rowcount
+
+
+def _fts_ids(match, owner_id, limit, offset=0):
+    # Every match is ranked before the page is cut, so the best rows come first
+    # however many there are; a very common term costs a bm25 score per match.
+    # CROSS JOIN keeps SQLite from driving the join from the projects table.
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT p.id FROM {FTS_TABLE} f '
+            f'CROSS JOIN {Project._meta.db_table} p ON p.id = f.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s AND p.owner_id = %s '
+            f'ORDER BY f.rank, p.id LIMIT %s OFFSET %s',
+            [match, owner_id, limit, offset]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _sqlite_search(user, terms, limit, offset):
+    long_terms = [term for term in terms if len(term) >= 3]
+    short_terms = [term for term in terms if len(term) < 3]
+
+    if not long_terms:
+        # Trigrams need three characters; fall back to an indexed prefix match
+        queryset = Project.objects.filter(owner=user)
+        for term in short_terms:
+            queryset = queryset.filter(
+                Q(contract_no__istartswith=term) | Q(vote_no__istartswith=term) | Q(name_of_contractor__istartswith=term)
+            )
+        return list(queryset.order_by('contract_no', 'pk').values_list('pk', flat=True)[offset:offset + limit])
+
+    ids = _fts_ids(' AND '.join(_fts_string(term) for term in long_terms), user.pk, limit, offset)
+    if ids or offset:
+        return ids
+
+    # Nothing contains the terms as typed: look for rows sharing most of their trigrams
+    wanted = set().union(*(_trigrams(term) for term in long_terms))
+    candidates = _fts_ids(' OR '.join(_fts_string(gram) for gram in sorted(wanted)), user.pk, FUZZY_CANDIDATES)
+    texts = {
+        row[0]: ' '.join(row[1:])
+        for row in Project.objects.filter(pk__in=candidates).values_list('pk', *SEARCH_FIELDS)
+    }
+    return [
+        pk for pk in candidates
+        if len(wanted & _trigrams(texts.get(pk, ''))) / len(wanted) >= MIN_SIMILARITY
+    ][:limit]
+
+
+def _postgres_search(user, query, limit, offset):
+    from django.contrib.postgres.search import TrigramWordSimilarity
+    from django.db.models.functions import Greatest
+
+    matches = Q()
+    for field in SEARCH_FIELDS:
+        # trigram_word_similar compiles to the %> operator the GIN indexes serve
+        matches |= Q(**{f'{field}__trigram_word_similar': query})
+    return list(
+        Project.objects.filter(matches, owner=user)
+        .annotate(rank=Greatest(*[TrigramWordSimilarity(query, field) for field in SEARCH_FIELDS]))
+        .order_by('-rank', 'pk')
+        .values_list('pk', flat=True)[offset:offset + limit]
+    )
+
+
+def _substring_search(user, terms, limit, offset):
+    queryset = Project.objects.filter(owner=user)
+    for term in terms:
+        queryset = queryset.filter(
+            Q(contract_no__icontains=term) | Q(vote_no__icontains=term) | Q(name_of_contractor__icontains=term)
+        )
+    return list(queryset.order_by('contract_no', 'pk').values_list('pk', flat=True)[offset:offset + limit])
+
+
+def search_projects(user, query, page=1, per_page=20):
+    """
+    The user's projects matching query, best first, as (projects, has_next).
+    Projects carry the with_summary() annotations used by the project cards.
+    """
+    terms = _terms(query)
+    if not terms:
+        return [], False
+
+    offset = (page - 1) * per_page
+    # One extra row tells us whether there is a next page without a COUNT
+    if connection.vendor == 'postgresql':
+        ids = _postgres_search(user, ' '.join(terms), per_page + 1, offset)
+    elif _uses_fts():
+        ids = _sqlite_search(user, terms, per_page + 1, offset)
+    else:
+        ids = _substring_search(user, terms, per_page + 1, offset)
+
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    projects = Project.objects.filter(pk__in=ids).with_summary().in_bulk()
+    return [projects[pk] for pk in ids if pk in projects], has_next
@@ -0,0 +1,75 @@
+"""
+Process-local cache of the SystemSettings row.
+
+get_system_settings() keeps the settings object in memory, tagged with a
+version token held in Django's cache. At most once every
+SYSTEM_SETTINGS_RECHECK_SECONDS the token is read back from the cache (one
+cheap lookup, no query); if another worker has saved the settings since,
+the token differs and the row is loaded again. A change therefore reaches
+every worker that shares the cache within that interval: the file-based
+default covers the workers on one host, and a multi-host deployment needs
+REDIS_URL (checks.py warns under `check --deploy`).
+
+The returned object is shared by every caller in the process, so treat it as
+read-only; code that edits the settings should use SystemSettings.get_settings().
+"""
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from .settings_models import SystemSettings
+
+VERSION_KEY = 'certificates:system_settings:version'
+
+# (settings object, version token, time the token was last compared)
+_cached = None
+_lock = threading.Lock()
+
+
+def _shared_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # First use, or the cache lost the key: start a version that every worker will agree on
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_system_settings():
+    """The current SystemSettings, from process memory when it is still up to date"""
+    global _cached
+    recheck = getattr(settings, 'SYSTEM_SETTINGS_RECHECK_SECONDS', 2)
+    now = time.monotonic()
+    cached = _cached
+    if cached is not None and now - cached[2] < recheck:
+        return cached[0]
+
+    version = _shared_version()
+    if cached is not None and cached[1] == version:
+        _cached = (cached[0], version, now)
+        return cached[0]
+
+    # Read the version before the row, so a save committed in between leaves us one version behind, not ahead
+    system_settings = SystemSettings.get_settings()
+    if not connection.in_atomic_block:
+        # Rows read inside a transaction may still be rolled back; only committed values are kept
+        with _lock:
+            _cached = (system_settings, version, now)
+    return system_settings
+
+
+def invalidate():
+    """Drop this process's copy and, once the transaction commits, tell the other workers"""
+    global _cached
+    with _lock:
+        _cached = None
+
+    def publish():
+        global _cached
+        cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+        with _lock:
+            _cached = None
+
+    transaction.on_commit(publish)
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from decimal import Decimal
 
 
@@ -37,6 +38,7 @@ class SystemSettings(models.Model):
         default="This certificate is issued without prejudice to the rights and obligations of the parties under the Contract."
     )
     include_company_logo_in_pdf = models.BooleanField(default=True)
+    prerender_certificate_pdfs = models.BooleanField(default=False)
     
     # Approval Settings
     require_dual_approval = models.BooleanField(default=True)
@@ -168,17 +170,72 @@ class AuditLog(models.Model):
         ('LOGOUT', 'Logout'),
     ]
     
-    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # Indexed together with timestamp below
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
+    # Copied from user when the entry is written, so filtering and listing
+    # need no join and the name survives the user being deleted
+    username = models.CharField(max_length=150, blank=True)
     action = models.CharField(max_length=10, choices=ACTION_CHOICES)
     model_name = models.CharField(max_length=50)
     object_id = models.CharField(max_length=50, blank=True)
     description = models.TextField()
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the event happens, not when a buffered write reaches the table
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['-timestamp']
+        # One index per audit page filter, each ending in timestamp so a
+        # filtered page is read in order straight off the index
+        indexes = [
+            models.Index(fields=['timestamp', 'id']),
+            models.Index(fields=['action', 'timestamp']),
+            models.Index(fields=['model_name', 'timestamp']),
+            models.Index(fields=['user', 'timestamp']),
+            models.Index(fields=['username', 'timestamp']),
+        ]
+
+    def __str__(self):
+        return f"{self.username or 'System'} - {self.action} - {self.model_name} - {self.timestamp}"
+
+    def save(self, *args, **kwargs):
+        if self.user_id and not self.username:
+            self.username = self.user.username
+        super().save(*args, **kwargs)
+
+
+class SystemStatistics(models.Model):
+    """
+    Running totals for the statistics page, a single row kept current by
+    signal handlers (see stats.py) so the page never counts whole tables.
+    Signed counters, so a delete the counters never saw cannot fail; the
+    reconcile_statistics command corrects any drift.
+    """
+    user_count = models.BigIntegerField(default=0)
+    active_user_count = models.BigIntegerField(default=0)
+    project_count = models.BigIntegerField(default=0)
+    certificate_count = models.BigIntegerField(default=0)
+    reconciled_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "System Statistics"
+        verbose_name_plural = "System Statistics"
+
+    def __str__(self):
+        return f"System Statistics ({self.updated_at})"
+
+
+class MonthlyStatistics(models.Model):
+    """Projects and certificates created per calendar month, in the site's time zone"""
+    month = models.DateField(unique=True)
+    project_count = models.BigIntegerField(default=0)
+    certificate_count = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ['month']
+        verbose_name_plural = "Monthly Statistics"
 
     def __str__(self):
-        return f"{self.user} - {self.action} - {self.model_name} - {self.timestamp}"
+        return f"Statistics for {self.month:%B %Y}"
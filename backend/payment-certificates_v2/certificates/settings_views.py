@@ -4,16 +4,25 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views.generic import ListView
-from django.db import transaction
+from django.db import connection, transaction
 from django.core.paginator import Paginator
-from django.http import JsonResponse, HttpResponse
-from django.core.management import call_command
+from django.http import JsonResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.conf import settings
-import io
-import csv
-from .settings_models import SystemSettings, UserPreferences, AuditLog
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import datetime, time, timedelta
+from .settings_models import SystemSettings, UserPreferences, AuditLog, MonthlyStatistics
 from .settings_forms import SystemSettingsForm, UserPreferencesForm, ProfileUpdateForm
 from .models import Project, Certificate
+from . import audit, backup, pdf_cache
+from .exports import (
+    EXPORTS, export_rows, stream_csv, gzip_stream, parse_watermark, format_watermark, next_watermark,
+)
+from .pagination import KeysetPaginationMixin
+from . import recalculation
+from .settings_cache import get_system_settings
+from .stats import get_statistics
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +36,8 @@ def is_superuser(user):
 def system_settings(request):
     """System-wide settings (admin only)"""
     settings_obj = SystemSettings.get_settings()
+    # Binding the form mutates settings_obj, so remember the rates first
+    old_rates = (settings_obj.vat_rate, settings_obj.retention_rate)
     
     if request.method == 'POST':
         form = SystemSettingsForm(request.POST, request.FILES, instance=settings_obj)
@@ -38,15 +49,15 @@ def system_settings(request):
                     settings_obj.save()
                     
                     # Log the action
-                    AuditLog.objects.create(
-                        user=request.user,
-                        action='UPDATE',
-                        model_name='SystemSettings',
-                        object_id='1',
-                        description='System settings updated',
-                        ip_address=request.META.get('REMOTE_ADDR'),
-                        user_agent=request.META.get('HTTP_USER_AGENT', '')
-                    )
+                    audit.record('UPDATE', 'SystemSettings', 'System settings updated', request=request, object_id='1')
+                    
+                    new_rates = (settings_obj.vat_rate, settings_obj.retention_rate)
+                    if new_rates != old_rates:
+                        # Queued in the same transaction as the new rates, so neither is saved without the other
+                        recalculation.enqueue(*new_rates)
+                        if not getattr(settings, 'CERTIFICATE_RECALCULATION_ASYNC', True):
+                            transaction.on_commit(recalculation.process_pending)
+                        messages.info(request, 'VAT/retention rates changed; existing certificates are being recalculated.')
                     
                     messages.success(request, 'System settings updated successfully!')
                     logger.info(f'System settings updated by {request.user.username}')
@@ -107,32 +118,43 @@ def user_preferences(request):
     })
 
 
-class AuditLogView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class AuditLogView(LoginRequiredMixin, UserPassesTestMixin, KeysetPaginationMixin, ListView):
     model = AuditLog
     template_name = 'certificates/settings/audit_log.html'
     context_object_name = 'logs'
     paginate_by = 25
+    # Served by the (timestamp, id) index
+    keyset_ordering = ['-timestamp', '-pk']
 
     def test_func(self):
         return self.request.user.is_superuser
 
     def get_queryset(self):
+        # username is stored on the row, so the user table is never joined
         queryset = AuditLog.objects.all()
         
-        # Filter by user
-        user_filter = self.request.GET.get('user')
+        # Filter by user: exact username, or a prefix ending in *
+        user_filter = self.request.GET.get('user', '').strip()
         if user_filter:
-            queryset = queryset.filter(user__username__icontains=user_filter)
+            queryset = queryset.filter(_exact_or_prefix('username', user_filter))
         
         # Filter by action
         action_filter = self.request.GET.get('action')
         if action_filter:
             queryset = queryset.filter(action=action_filter)
         
-        # Filter by model
-        model_filter = self.request.GET.get('model')
+        # Filter by model: exact name, or a prefix ending in *
+        model_filter = self.request.GET.get('model', '').strip()
         if model_filter:
-            queryset = queryset.filter(model_name__icontains=model_filter)
+            queryset = queryset.filter(_exact_or_prefix('model_name', model_filter))
+        
+        # Filter by date range, both ends inclusive
+        date_from = _parse_day(self.request.GET.get('from'))
+        if date_from:
+            queryset = queryset.filter(timestamp__gte=_start_of_day(date_from))
+        date_to = _parse_day(self.request.GET.get('to'))
+        if date_to:
+            queryset = queryset.filter(timestamp__lt=_start_of_day(date_to + timedelta(days=1)))
         
         return queryset
 
@@ -143,62 +165,79 @@ class AuditLogView(LoginRequiredMixin, UserPassesTestMixin, ListView):
             'user': self.request.GET.get('user', ''),
             'action': self.request.GET.get('action', ''),
             'model': self.request.GET.get('model', ''),
+            'from': self.request.GET.get('from', ''),
+            'to': self.request.GET.get('to', ''),
         }
         return context
 
 
+def _exact_or_prefix(field, value):
+    """
+    Q for an exact match on field, or a prefix match if value ends in *.
+
+    On SQLite the prefix is also given as a range, which the (field,
+    timestamp) index serves where LIKE cannot; the range is exact there
+    because SQLite compares text by code point. Other databases compare
+    with locale collations, so they get the LIKE alone; on PostgreSQL the
+    varchar_pattern_ops indexes from migration 0015 serve it.
+    """
+    if not value.endswith('*'):
+        return Q(**{field: value})
+    prefix = value.rstrip('*')
+    if not prefix:
+        return Q()
+    if connection.vendor != 'sqlite':
+        return Q(**{f'{field}__startswith': prefix})
+    return Q(**{
+        f'{field}__gte': prefix,
+        f'{field}__lt': prefix + '\U0010ffff',
+        f'{field}__startswith': prefix,
+    })
+
+
+def _parse_day(value):
+    """date from a YYYY-MM-DD query parameter, or None if it is missing or invalid"""
+    try:
+        return parse_date(value or '')
+    except ValueError:
+        return None
+
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
 @login_required
 @user_passes_test(is_superuser)
 def system_statistics(request):
     """System statistics and analytics"""
     try:
-        # Basic statistics
-        total_users = User.objects.count()
-        total_projects = Project.objects.count()
-        total_certificates = Certificate.objects.count()
+        # Running totals kept by signals (see stats.py), so nothing here counts a whole table
+        statistics = get_statistics()
         
-        # Recent activity
-        recent_projects = Project.objects.order_by('-created_at')[:5]
-        recent_certificates = Certificate.objects.select_related('project').order_by('-created_at')[:5]
+        # Recent activity, newest first by primary key
+        recent_projects = Project.objects.order_by('-pk')[:5]
+        recent_certificates = Certificate.objects.select_related('project').order_by('-pk')[:5]
         recent_logs = AuditLog.objects.order_by('-timestamp')[:10]
         
-        # User activity
-        active_users = User.objects.filter(last_login__isnull=False).count()
-        
         # Monthly statistics (last 6 months)
-        from django.utils import timezone
-        from datetime import timedelta
-        from django.db.models import Count
-        from django.db.models.functions import TruncMonth
-        
-        six_months_ago = timezone.now() - timedelta(days=180)
-        
-        monthly_projects = Project.objects.filter(
-            created_at__gte=six_months_ago
-        ).annotate(
-            month=TruncMonth('created_at')
-        ).values('month').annotate(
-            count=Count('id')
-        ).order_by('month')
-        
-        monthly_certificates = Certificate.objects.filter(
-            created_at__gte=six_months_ago
-        ).annotate(
-            month=TruncMonth('created_at')
-        ).values('month').annotate(
-            count=Count('id')
-        ).order_by('month')
+        today = timezone.localdate()
+        first_month = today.replace(day=1)
+        for _ in range(5):
+            first_month = (first_month - timedelta(days=1)).replace(day=1)
+        monthly = list(MonthlyStatistics.objects.filter(month__gte=first_month).order_by('month'))
         
         context = {
-            'total_users': total_users,
-            'total_projects': total_projects,
-            'total_certificates': total_certificates,
-            'active_users': active_users,
+            'total_users': statistics.user_count,
+            'total_projects': statistics.project_count,
+            'total_certificates': statistics.certificate_count,
+            'active_users': statistics.active_user_count,
+            'statistics': statistics,
             'recent_projects': recent_projects,
             'recent_certificates': recent_certificates,
             'recent_logs': recent_logs,
-            'monthly_projects': list(monthly_projects),
-            'monthly_certificates': list(monthly_certificates),
+            'monthly': monthly,
+            'pdf_cache_stats': pdf_cache.stats(),
         }
         
         return render(request, 'certificates/settings/statistics.html', context)
@@ -212,107 +251,72 @@ def system_statistics(request):
 @login_required
 @user_passes_test(is_superuser)
 def export_data(request):
-    """Export system data"""
+    """
+    Stream system data as CSV. certificates with wide=1 adds the project and
+    calculated totals to each row; gzip=1 sends a .csv.gz instead. With
+    since=<watermark> only rows changed after it are sent; every response
+    carries the watermark for the next delta in X-Export-Watermark.
+    """
     export_type = request.GET.get('type', 'projects')
-    
-    try:
-        response = HttpResponse(content_type='text/csv')
-        
-        if export_type == 'projects':
-            response['Content-Disposition'] = 'attachment; filename="projects.csv"'
-            writer = csv.writer(response)
-            writer.writerow(['ID', 'Contractor', 'Contract No', 'Vote No', 'Tender Sum', 'Owner', 'Created At'])
-            
-            for project in Project.objects.select_related('owner'):
-                writer.writerow([
-                    project.id,
-                    project.name_of_contractor,
-                    project.contract_no,
-                    project.vote_no,
-                    project.tender_sum,
-                    project.owner.username,
-                    project.created_at.strftime('%Y-%m-%d %H:%M:%S')
-                ])
-        
-        elif export_type == 'certificates':
-            response['Content-Disposition'] = 'attachment; filename="certificates.csv"'
-            writer = csv.writer(response)
-            writer.writerow(['ID', 'Project', 'Currency', 'Current Claim', 'VAT', 'Previous Payment', 'Created At'])
-            
-            for cert in Certificate.objects.select_related('project'):
-                writer.writerow([
-                    cert.id,
-                    cert.project.name_of_contractor,
-                    cert.currency,
-                    cert.current_claim_excl_vat,
-                    cert.vat_value,
-                    cert.previous_payment_excl_vat,
-                    cert.created_at.strftime('%Y-%m-%d %H:%M:%S')
-                ])
-        
-        elif export_type == 'audit_logs':
-            response['Content-Disposition'] = 'attachment; filename="audit_logs.csv"'
-            writer = csv.writer(response)
-            writer.writerow(['User', 'Action', 'Model', 'Object ID', 'Description', 'IP Address', 'Timestamp'])
-            
-            for log in AuditLog.objects.select_related('user'):
-                writer.writerow([
-                    log.user.username if log.user else 'System',
-                    log.action,
-                    log.model_name,
-                    log.object_id,
-                    log.description,
-                    log.ip_address,
-                    log.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-                ])
-        
-        # Log the export
-        AuditLog.objects.create(
-            user=request.user,
-            action='EXPORT',
-            model_name=export_type.title(),
-            description=f'Exported {export_type} data',
-            ip_address=request.META.get('REMOTE_ADDR'),
-            user_agent=request.META.get('HTTP_USER_AGENT', '')
-        )
-        
-        return response
-        
-    except Exception as e:
-        logger.error(f'Error exporting data: {str(e)}')
-        messages.error(request, 'Failed to export data. Please try again.')
+    if export_type == 'certificates' and request.GET.get('wide') == '1':
+        export_type = 'certificates_wide'
+    if export_type not in EXPORTS:
+        messages.error(request, 'Unknown export type.')
         return redirect('system_statistics')
 
+    since = None
+    if request.GET.get('since'):
+        try:
+            since = parse_watermark(request.GET['since'])
+        except ValueError:
+            return HttpResponseBadRequest('since must be an ISO 8601 date and time, e.g. a previous X-Export-Watermark')
+    until = next_watermark(since)
+
+    filename, header, rows = export_rows(export_type, since, until)
+    content = stream_csv(header, rows)
+    content_type = 'text/csv'
+    if request.GET.get('gzip') == '1':
+        content = gzip_stream(content)
+        content_type = 'application/gzip'
+        filename += '.gz'
+
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Export-Watermark'] = format_watermark(until)
+
+    # Log the export
+    description = f'Exported {export_type} data' + (f' changed since {format_watermark(since)}' if since else '')
+    audit.record('EXPORT', export_type.title(), description, request=request)
+
+    return response
+
 
 @login_required
 @user_passes_test(is_superuser)
 def system_backup(request):
-    """Create system backup"""
+    """Stream a compressed backup of the database, or with store=1 save it to BACKUP_DIR"""
     if request.method == 'POST':
-        try:
-            # Create a database backup using Django's dumpdata command
-            output = io.StringIO()
-            call_command('dumpdata', '--natural-foreign', '--natural-primary', stdout=output)
-            
-            response = HttpResponse(output.getvalue(), content_type='application/json')
-            response['Content-Disposition'] = f'attachment; filename="backup_{timezone.now().strftime("%Y%m%d_%H%M%S")}.json"'
-            
-            # Log the backup
-            AuditLog.objects.create(
-                user=request.user,
-                action='EXPORT',
-                model_name='SystemBackup',
-                description='System backup created',
-                ip_address=request.META.get('REMOTE_ADDR'),
-                user_agent=request.META.get('HTTP_USER_AGENT', '')
-            )
-            
-            return response
-            
-        except Exception as e:
-            logger.error(f'Error creating backup: {str(e)}')
-            messages.error(request, 'Failed to create backup. Please try again.')
-    
+        name = backup.backup_name()
+        if request.POST.get('store') == '1':
+            try:
+                path = backup.write_backup(name)
+            except Exception as e:
+                logger.error(f'Error creating backup: {str(e)}')
+                messages.error(request, 'Failed to create backup. Please try again.')
+                return redirect('system_settings')
+
+            audit.record('EXPORT', 'SystemBackup', f'System backup saved as {path.name}', request=request)
+            messages.success(request, f'Backup saved as {path.name}.')
+            return redirect('settings_dashboard')
+
+        response = StreamingHttpResponse(backup.stream_backup(name), content_type='application/gzip')
+        response['Content-Disposition'] = f'attachment; filename="{name}"'
+
+        # Log the backup
+        audit.record('EXPORT', 'SystemBackup', 'System backup created', request=request)
+
+        return response
+
     return redirect('system_settings')
 
 
@@ -325,7 +329,7 @@ def settings_dashboard(request):
     }
     
     if request.user.is_superuser:
-        context['system_settings'] = SystemSettings.get_settings()
+        context['system_settings'] = get_system_settings()
         context['recent_logs'] = AuditLog.objects.order_by('-timestamp')[:5]
     
     return render(request, 'certificates/settings/dashboard.html', context)
@@ -0,0 +1,186 @@
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from .models import (
+    Project, Certificate, Calculations, ProjectLedger, Tombstone, calculations_stored, get_calculation_rates,
+)
+from .settings_models import SystemSettings
+from . import ledger, money, search, settings_cache, stats
+
+
+def _project_id(calculations):
+    # Certificate.save() hands its own instance to get_or_create, so this is usually cached
+    return calculations.certificate.project_id
+
+
+def _cascaded(origin, model):
+    """Whether a delete signal was set off by deleting something else (a project, a user) rather than model itself"""
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return origin is not None and origin_model is not model
+
+
+@receiver(post_save, sender=Project)
+def create_project_ledger(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        ProjectLedger.objects.get_or_create(project=instance)
+
+
+@receiver(post_save, sender=Calculations)
+def update_ledger_on_calculations_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    project_id = _project_id(instance)
+    current = instance.ledger_values()
+    previous = getattr(instance, '_ledger_snapshot', None)
+
+    if created:
+        ledger.apply_delta(project_id, 1, current)
+    elif previous is not None:
+        ledger.apply_delta(project_id, 0, [new - old for new, old in zip(current, previous)])
+    else:
+        # Saved without knowing the old values; fall back to a full recount
+        ledger.rebuild_ledgers(Project.objects.filter(pk=project_id))
+    instance._ledger_snapshot = current
+
+
+@receiver(post_delete, sender=Calculations)
+def update_ledger_on_calculations_delete(sender, instance, **kwargs):
+    values = getattr(instance, '_ledger_snapshot', None) or instance.ledger_values()
+    # When the whole project is being deleted its ledger may already be gone;
+    # rebuilding it then would resurrect a row for a project about to vanish
+    ledger.apply_delta(_project_id(instance), -1, [-value for value in values], rebuild_missing=False)
+
+
+def _computed_ledger_values(claim):
+    """A claim's contribution to each ledger total in computed mode, in LEDGER_SOURCES order"""
+    values = money.calculation_values(claim, *get_calculation_rates())
+    return [values[field] for field in ledger.LEDGER_SOURCES.values()]
+
+
+@receiver(post_save, sender=Certificate)
+def update_ledger_on_certificate_save(sender, instance, created, raw=False, **kwargs):
+    # In computed mode there are no Calculations rows to hang the ledger off
+    if raw or calculations_stored():
+        return
+    current = (instance.project_id, instance.current_claim_excl_vat)
+    previous = getattr(instance, '_ledger_snapshot', None)
+
+    if created:
+        ledger.apply_delta(instance.project_id, 1, _computed_ledger_values(instance.current_claim_excl_vat))
+    elif previous is None:
+        # Saved without knowing the old claim; fall back to a full recount
+        ledger.rebuild_ledgers(Project.objects.filter(pk=instance.project_id))
+    elif previous[0] != instance.project_id:
+        old_project_id, old_claim = previous
+        ledger.apply_delta(old_project_id, -1, [-value for value in _computed_ledger_values(old_claim)])
+        ledger.apply_delta(instance.project_id, 1, _computed_ledger_values(instance.current_claim_excl_vat))
+    elif previous[1] != instance.current_claim_excl_vat:
+        old = _computed_ledger_values(previous[1])
+        new = _computed_ledger_values(instance.current_claim_excl_vat)
+        ledger.apply_delta(instance.project_id, 0, [n - o for n, o in zip(new, old)])
+    instance._ledger_snapshot = current
+
+
+@receiver(post_delete, sender=Certificate)
+def update_ledger_on_certificate_delete(sender, instance, **kwargs):
+    if calculations_stored():
+        return
+    project_id, claim = getattr(instance, '_ledger_snapshot', None) or (
+        instance.project_id, instance.current_claim_excl_vat
+    )
+    # Never rebuild a missing ledger; see update_ledger_on_calculations_delete
+    ledger.apply_delta(project_id, -1, [-value for value in _computed_ledger_values(claim)], rebuild_missing=False)
+
+
+@receiver(post_save, sender=Project)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_project(instance)
+
+
+@receiver(post_delete, sender=Project)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.unindex_project(instance.pk)
+
+
+@receiver(post_save, sender=Project)
+def count_new_project(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.record_rows('project_count', [instance.created_at])
+
+
+@receiver(post_delete, sender=Project)
+def count_deleted_project(sender, instance, **kwargs):
+    stats.record_rows('project_count', [instance.created_at], sign=-1)
+
+
+@receiver(post_save, sender=Certificate)
+def count_new_certificate(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.record_rows('certificate_count', [instance.created_at])
+
+
+@receiver(pre_delete, sender=Project)
+def uncount_project_certificates(sender, instance, **kwargs):
+    # One grouped query for the whole cascade instead of a delta per certificate
+    stats.remove_project_certificates(instance.pk)
+
+
+@receiver(post_delete, sender=Certificate)
+def count_deleted_certificate(sender, instance, origin=None, **kwargs):
+    if _cascaded(origin, Certificate):
+        # Deleted along with its project; uncount_project_certificates has counted it
+        return
+    stats.record_rows('certificate_count', [instance.created_at], sign=-1)
+
+
+@receiver(pre_delete, sender=Project)
+def bury_project_certificates(sender, instance, **kwargs):
+    # One INSERT for the whole cascade; bury_certificate skips these
+    Tombstone.objects.bulk_create([
+        Tombstone(model_name='Certificate', object_id=pk)
+        for pk in Certificate.objects.filter(project=instance).values_list('pk', flat=True)
+    ], batch_size=500)
+
+
+@receiver(post_delete, sender=Project)
+def bury_project(sender, instance, **kwargs):
+    Tombstone.objects.create(model_name='Project', object_id=instance.pk)
+
+
+@receiver(post_delete, sender=Certificate)
+def bury_certificate(sender, instance, origin=None, **kwargs):
+    if not _cascaded(origin, Certificate):
+        Tombstone.objects.create(model_name='Certificate', object_id=instance.pk)
+
+
+@receiver(pre_save, sender=User)
+def note_first_login(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Only a save that sets last_login on an existing user can make them active
+    instance._first_login = False
+    if raw or instance._state.adding or instance.last_login is None:
+        return
+    if update_fields is not None and 'last_login' not in update_fields:
+        return
+    instance._first_login = User.objects.filter(pk=instance.pk, last_login__isnull=True).exists()
+
+
+@receiver(post_save, sender=User)
+def count_user(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        stats.apply_delta(user_count=1, active_user_count=1 if instance.last_login else 0)
+    elif getattr(instance, '_first_login', False):
+        stats.apply_delta(active_user_count=1)
+
+
+@receiver(post_delete, sender=User)
+def count_deleted_user(sender, instance, **kwargs):
+    stats.apply_delta(user_count=-1, active_user_count=-1 if instance.last_login else 0)
+
+
+@receiver(post_save, sender=SystemSettings)
+def invalidate_cached_settings(sender, **kwargs):
+    settings_cache.invalidate()
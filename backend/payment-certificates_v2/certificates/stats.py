@@ -0,0 +1,136 @@
+"""
+Incremental maintenance of the statistics page counters.
+
+Signal handlers add +1/-1 to the SystemStatistics row and to the month the
+row was created in, with F() expressions, so the page reads one row and a
+handful of months instead of counting and grouping whole tables. Bulk
+writes pass their own deltas through record_rows; anything that bypasses
+both (raw SQL, loaddata) is picked up by rebuild_statistics, which the
+reconcile_statistics command runs.
+
+Every worker's writes meet on the one SystemStatistics row and the current
+month's row, so the deltas are applied only once the caller's transaction
+commits, in a short transaction of their own. A request never holds those
+row locks while it does the rest of its work. A process that dies between
+the commit and the update leaves drift for reconcile_statistics to correct.
+"""
+from collections import Counter
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, DateField, F
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from .models import Project, Certificate
+from .settings_models import SystemStatistics, MonthlyStatistics
+
+STATISTICS_PK = 1
+# Fields of SystemStatistics that rebuild_statistics recounts
+COUNTERS = ['user_count', 'active_user_count', 'project_count', 'certificate_count']
+
+
+def month_of(moment):
+    """First day of the month moment falls in, in the current time zone (as TruncMonth does)"""
+    return timezone.localdate(moment).replace(day=1)
+
+
+def apply_delta(months=None, **counts):
+    """
+    Add counts (SystemStatistics field -> delta) to the totals, and months
+    ({first of month: {field: delta}}) to the monthly rollup, once the
+    current transaction commits. Nothing is added if it rolls back.
+    """
+    # robust: the caller's data is already committed, so a failure here is only logged
+    transaction.on_commit(lambda: _apply_delta(months or {}, counts), robust=True)
+
+
+def _apply_delta(months, counts):
+    """Apply a delta now; a missing statistics row is rebuilt from scratch, which already includes it"""
+    changes = {field: F(field) + delta for field, delta in counts.items() if delta}
+    with transaction.atomic():
+        if changes and not SystemStatistics.objects.filter(pk=STATISTICS_PK).update(**changes):
+            rebuild_statistics()
+            return
+
+        for month, deltas in months.items():
+            monthly = {field: F(field) + delta for field, delta in deltas.items() if delta}
+            if not monthly:
+                continue
+            if not MonthlyStatistics.objects.filter(month=month).update(**monthly):
+                MonthlyStatistics.objects.get_or_create(month=month)
+                MonthlyStatistics.objects.filter(month=month).update(**monthly)
+
+
+def record_rows(field, created_ats, sign=1):
+    """Count rows created at created_ats into field (project_count or certificate_count); sign=-1 for deletes"""
+    per_month = Counter(month_of(created_at) for created_at in created_ats)
+    apply_delta(
+        months={month: {field: sign * count} for month, count in per_month.items()},
+        **{field: sign * sum(per_month.values())}
+    )
+
+
+def _monthly_counts(queryset):
+    return dict(
+        queryset.annotate(month=TruncMonth('created_at', output_field=DateField()))
+        .values('month').annotate(count=Count('pk')).order_by().values_list('month', 'count')
+    )
+
+
+def remove_project_certificates(project_id):
+    """Uncount every certificate of a project that is about to be deleted"""
+    per_month = _monthly_counts(Certificate.objects.filter(project_id=project_id))
+    apply_delta(
+        months={month: {'certificate_count': -count} for month, count in per_month.items()},
+        certificate_count=-sum(per_month.values())
+    )
+
+
+def rebuild_statistics():
+    """
+    Recount every counter and month from the tables. Returns the counters
+    that had drifted as [(name, stored, actual)], months included.
+    """
+    with transaction.atomic():
+        statistics, _ = SystemStatistics.objects.select_for_update().get_or_create(pk=STATISTICS_PK)
+        actual = {
+            'user_count': User.objects.count(),
+            'active_user_count': User.objects.filter(last_login__isnull=False).count(),
+            'project_count': Project.objects.count(),
+            'certificate_count': Certificate.objects.count(),
+        }
+        drift = [(field, getattr(statistics, field), actual[field])
+                 for field in COUNTERS if getattr(statistics, field) != actual[field]]
+
+        projects = _monthly_counts(Project.objects.all())
+        certificates = _monthly_counts(Certificate.objects.all())
+        stored = {row.month: row for row in MonthlyStatistics.objects.all()}
+        months = []
+        for month in sorted(set(projects) | set(certificates) | set(stored)):
+            row = MonthlyStatistics(
+                month=month,
+                project_count=projects.get(month, 0),
+                certificate_count=certificates.get(month, 0),
+            )
+            for field in ['project_count', 'certificate_count']:
+                old_value = getattr(stored[month], field) if month in stored else 0
+                if old_value != getattr(row, field):
+                    drift.append((f'{month:%Y-%m} {field}', old_value, getattr(row, field)))
+            if row.project_count or row.certificate_count:
+                months.append(row)
+
+        MonthlyStatistics.objects.all().delete()
+        MonthlyStatistics.objects.bulk_create(months)
+        for field, value in actual.items():
+            setattr(statistics, field, value)
+        statistics.reconciled_at = timezone.now()
+        statistics.save()
+    return drift
+
+
+def get_statistics():
+    """The statistics row, built from the tables the first time it is needed"""
+    statistics = SystemStatistics.objects.filter(pk=STATISTICS_PK).first()
+    if statistics is None:
+        rebuild_statistics()
+        statistics = SystemStatistics.objects.get(pk=STATISTICS_PK)
+    return statistics
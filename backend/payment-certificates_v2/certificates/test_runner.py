@@ -0,0 +1,32 @@
+"""
+Test runner for the project (settings.TEST_RUNNER).
+
+Settings that only make sense outside tests are overridden here for the
+whole run, rather than by sniffing sys.argv in settings.py. Individual tests
+can still switch them back with override_settings.
+"""
+import shutil
+import tempfile
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+TEST_SETTINGS = {
+    # Save each audit entry immediately instead of queueing it for the writer thread
+    'AUDIT_ASYNC': False,
+    # A cache of the test run's own, never the file cache a development server on this checkout uses
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}},
+}
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        # Rendered PDFs go to a directory of the run's own, not the checkout's cache/pdf
+        self._pdf_cache_dir = tempfile.mkdtemp(prefix='pdf-cache-tests-')
+        self._test_settings = override_settings(**TEST_SETTINGS, PDF_CACHE_DIR=self._pdf_cache_dir)
+        self._test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_settings.disable()
+        shutil.rmtree(self._pdf_cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -19,6 +19,7 @@ urlpatterns = [
     # Projects
     path('projects/', views.project_list, name='project_list'),
     path('projects/new/', views.project_create, name='project_create'),
+    path('projects/search/', views.project_search, name='project_search'),
     path('projects/<int:pk>/', views.project_detail, name='project_detail'),
     path('projects/<int:pk>/edit/', views.project_update, name='project_update'),
     path('projects/<int:pk>/delete/', views.project_delete, name='project_delete'),
@@ -27,6 +28,11 @@ urlpatterns = [
     path('projects/<int:project_pk>/certificates/new/', views.certificate_create, name='certificate_create'),
     path('projects/<int:project_pk>/certificates/<int:pk>/', views.certificate_detail, name='certificate_detail'),
     path('projects/<int:project_pk>/certificates/<int:pk>/pdf/', views.certificate_pdf, name='certificate_pdf'),
+    path('projects/<int:project_pk>/certificates/bulk/', views.certificate_bulk_create, name='certificate_bulk_create'),
+    path('projects/<int:project_pk>/certificates/zip/', views.project_certificates_zip, name='project_certificates_zip'),
+    path('certificates/print-pack/', views.certificate_print_pack, name='certificate_print_pack'),
+    path('pdf-jobs/<int:pk>/', views.pdf_job_status, name='pdf_job_status'),
+    path('pdf-jobs/<int:pk>/download/', views.pdf_job_download, name='pdf_job_download'),
     
     # Settings
     path('settings/', settings_views.settings_dashboard, name='settings_dashboard'),
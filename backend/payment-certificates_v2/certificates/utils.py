@@ -1,12 +1,32 @@
+import hashlib
 import io
+import logging
+import re
+import zipfile
+from django.core.exceptions import ObjectDoesNotExist
 from django.http import HttpResponse
-from reportlab.pdfgen import canvas
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe
 from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.units import inch
-from datetime import datetime
+from reportlab.pdfgen import canvas
+from reportlab.platypus import SimpleDocTemplate, Frame
+from . import pdf_cache
+from .pdf_concat import PdfConcatenator
+from .pdf_layout import get_layout
+from .settings_cache import get_system_settings
+
+logger = logging.getLogger(__name__)
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Certificates drawn on one canvas before it is appended to a print pack
+PRINT_PACK_BATCH_SIZE = 50
+
+
+def get_render_date():
+    """Date printed on certificates rendered now"""
+    return timezone.localdate().strftime('%B %d, %Y')
 
 
 def generate_certificate_pdf(project, certificate, calculations):
@@ -14,121 +34,203 @@ def generate_certificate_pdf(project, certificate, calculations):
     # Create the HttpResponse object with PDF headers
     response = HttpResponse(content_type='application/pdf')
     response['Content-Disposition'] = f'attachment; filename="certificate_{certificate.id}.pdf"'
-    
-    # Create the PDF object
+    response.write(get_certificate_pdf_bytes(project, certificate, calculations))
+    return response
+
+
+def certificate_pdf_validators(project, certificate, system_settings):
+    """Return (etag, last_modified) for a certificate PDF without rendering it"""
+    render_date = get_render_date()
+    # The printed date rolls over at midnight, so the document does too
+    start_of_day = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    last_modified = max(certificate.updated_at, project.updated_at, system_settings.updated_at, start_of_day)
+
+    digest = hashlib.sha256()
+    for part in [certificate.pk, certificate.updated_at, project.updated_at, system_settings.updated_at, render_date]:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\x1f')
+    return f'"{digest.hexdigest()[:32]}"', last_modified
+
+
+def _requested_range(request, size, etag, last_modified):
+    """Parse a single byte range; None means send the whole body, False means unsatisfiable"""
+    header = request.META.get('HTTP_RANGE', '')
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Multiple ranges or other units: answering with the full body is allowed
+        return None
+
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range:
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            if if_range != etag:
+                return None
+        elif last_modified is None or parse_http_date_safe(if_range) != int(last_modified.timestamp()):
+            return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the final N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def build_pdf_response(request, pdf, filename, etag=None, last_modified=None):
+    """Serve PDF bytes with validators and single byte-range support"""
+    response = HttpResponse(content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Accept-Ranges'] = 'bytes'
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+
+    byte_range = _requested_range(request, len(pdf), etag, last_modified)
+    if byte_range is False:
+        response.status_code = 416
+        response['Content-Range'] = f'bytes */{len(pdf)}'
+        return response
+    if byte_range:
+        start, end = byte_range
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{len(pdf)}'
+        response.write(pdf[start:end + 1])
+        return response
+
+    response.write(pdf)
+    return response
+
+
+class _ZipStreamBuffer:
+    """Write-only file object that hands back whatever zipfile wrote since the last pop"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_certificates_zip(project, certificates):
+    """Yield a ZIP archive of certificate PDFs, rendering one certificate at a time"""
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for certificate in certificates:
+            try:
+                calculations = certificate.get_calculations()
+            except ObjectDoesNotExist:
+                logger.warning(f'Calculations not found for certificate {certificate.pk}, skipping')
+                continue
+
+            pdf = get_certificate_pdf_bytes(project, certificate, calculations)
+            archive.writestr(f'certificate_{certificate.id}.pdf', pdf)
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def get_certificate_pdf_bytes(project, certificate, calculations, system_settings=None):
+    """Return the certificate PDF, serving it from the on-disk cache when possible"""
+    render_date = get_render_date()
+    if system_settings is None:
+        system_settings = get_system_settings()
+    key = pdf_cache.make_key(project, certificate, calculations, system_settings, render_date)
+
+    pdf = pdf_cache.load(key)
+    if pdf is None:
+        layout = get_layout(system_settings)
+        pdf = render_certificate_pdf(project, certificate, calculations, render_date, layout)
+        pdf_cache.store(key, pdf)
+    return pdf
+
+
+def render_certificate_pdf(project, certificate, calculations, render_date=None, layout=None):
+    """Render the certificate PDF and return its bytes"""
+    if render_date is None:
+        render_date = get_render_date()
+    if layout is None:
+        layout = get_layout(get_system_settings())
+
+    # Invariant output keeps identical inputs byte-identical, which the strong
+    # ETag and byte-range resumption rely on
     buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    
-    # Container for the 'Flowable' objects
-    elements = []
-    
-    # Define styles
-    styles = getSampleStyleSheet()
-    title_style = styles['Title']
-    heading_style = styles['Heading2']
-    normal_style = styles['Normal']
-    
-    # Add title
-    title = Paragraph("PAYMENT CERTIFICATE", title_style)
-    elements.append(title)
-    elements.append(Spacer(1, 12))
-    
-    # Add certificate info
-    cert_info = Paragraph(f"Certificate #{certificate.id}", normal_style)
-    elements.append(cert_info)
-    elements.append(Spacer(1, 12))
-    
-    # Project details section
-    project_heading = Paragraph("Project Details", heading_style)
-    elements.append(project_heading)
-    elements.append(Spacer(1, 6))
-    
-    project_data = [
-        ['Contractor:', project.name_of_contractor],
-        ['Contract No:', project.contract_no],
-        ['Vote No:', project.vote_no],
-        ['Tender Sum:', f"{certificate.currency} {project.tender_sum:,.2f}"],
-        ['Currency:', certificate.currency],
-        ['Date:', datetime.now().strftime('%B %d, %Y')],
-    ]
-    
-    project_table = Table(project_data, colWidths=[2*inch, 4*inch])
-    project_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-    ]))
-    
-    elements.append(project_table)
-    elements.append(Spacer(1, 20))
-    
-    # Certificate summary section
-    summary_heading = Paragraph("Certificate Summary", heading_style)
-    elements.append(summary_heading)
-    elements.append(Spacer(1, 6))
-    
-    summary_data = [
-        ['Description', f'Amount ({certificate.currency})'],
-        ['Current Claim (Excl. VAT)', f'{certificate.current_claim_excl_vat:,.2f}'],
-        ['VAT (15%)', f'{certificate.vat_value:,.2f}'],
-        ['Previous Payment (Excl. VAT)', f'{certificate.previous_payment_excl_vat:,.2f}'],
-        ['Value of Work Done (Incl. VAT)', f'{calculations.value_of_workdone_incl_vat:,.2f}'],
-        ['Total Value of Work Done (Excl. VAT)', f'{calculations.total_value_of_workdone_excl_vat:,.2f}'],
-        ['Retention (10%)', f'{calculations.retention:,.2f}'],
-        ['Total Amount Payable', f'{calculations.total_amount_payable:,.2f}'],
-    ]
-    
-    summary_table = Table(summary_data, colWidths=[4*inch, 2*inch])
-    summary_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('ALIGN', (1, 1), (1, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    elements.append(summary_table)
-    elements.append(Spacer(1, 30))
-    
-    # Approval section
-    approval_heading = Paragraph("Approval", heading_style)
-    elements.append(approval_heading)
-    elements.append(Spacer(1, 20))
-    
-    approval_data = [
-        ['_' * 30, '_' * 30],
-        ['Authorized Signature', 'Authorized Signature'],
-        ['Project Manager', 'Finance Officer'],
-    ]
-    
-    approval_table = Table(approval_data, colWidths=[3*inch, 3*inch])
-    approval_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica-Bold'),
-    ]))
-    
-    elements.append(approval_table)
-    elements.append(Spacer(1, 20))
-    
-    # Footer
-    footer_text = "This certificate is issued without prejudice to the rights and obligations of the parties under the Contract."
-    footer = Paragraph(footer_text, normal_style)
-    elements.append(footer)
-    
-    # Build PDF
-    doc.build(elements)
-    
-    # Get the value of the BytesIO buffer and write it to the response
+    doc = SimpleDocTemplate(buffer, pagesize=A4, invariant=1)
+    doc.build(layout.build_story(project, certificate, calculations, render_date))
+
     pdf = buffer.getvalue()
     buffer.close()
-    response.write(pdf)
-    
-    return response
+    return pdf
+
+
+def write_print_pack(fileobj, certificates, render_date=None, layout=None, batch_size=None):
+    """
+    Draw many certificates into one PDF written to fileobj.
+
+    A ReportLab canvas keeps every page until it is saved, so certificates
+    are drawn batch_size (PRINT_PACK_BATCH_SIZE) at a time into a small
+    in-memory PDF, and each batch is appended to fileobj by a
+    PdfConcatenator as soon as it is finished. Memory is bounded by one
+    batch however many certificates the pack holds.
+    Returns the number of certificates written.
+    """
+    if render_date is None:
+        render_date = get_render_date()
+    if layout is None:
+        layout = get_layout(get_system_settings())
+    batch_size = batch_size or PRINT_PACK_BATCH_SIZE
+
+    width, height = A4
+    output = PdfConcatenator(fileobj)
+    buffer = pdf = None
+    count = 0
+    for certificate in certificates:
+        try:
+            calculations = certificate.get_calculations()
+        except ObjectDoesNotExist:
+            logger.warning(f'Calculations not found for certificate {certificate.pk}, skipping')
+            continue
+
+        if pdf is None:
+            buffer = io.BytesIO()
+            pdf = canvas.Canvas(buffer, pagesize=A4, pageCompression=1)
+        story = layout.build_story(certificate.project, certificate, calculations, render_date)
+        while story:
+            remaining = len(story)
+            frame = Frame(inch, inch, width - 2 * inch, height - 2 * inch)
+            frame.addFromList(story, pdf)
+            pdf.showPage()
+            if len(story) == remaining:
+                raise ValueError(f'Certificate {certificate.pk} does not fit on a page')
+        count += 1
+
+        if count % batch_size == 0:
+            pdf.save()
+            output.append(buffer.getvalue())
+            buffer = pdf = None
+
+    if pdf is None and count == 0:
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4, pageCompression=1)
+        pdf.showPage()
+    if pdf is not None:
+        pdf.save()
+        output.append(buffer.getvalue())
+    output.close()
+    return count
@@ -1,18 +1,32 @@
+import hashlib
+import json
 import logging
+import tempfile
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, Http404, StreamingHttpResponse, JsonResponse, FileResponse
 from django.core.exceptions import PermissionDenied
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.urls import reverse_lazy, reverse
-from .models import Project, Certificate, Calculations
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date
+from django.views.decorators.http import require_POST
+from .models import Project, Certificate, Calculations, PdfRenderJob, BulkCertificateRequest, get_calculation_rates
 from .forms import ProjectForm, CertificateForm
 from .auth_forms import CustomUserCreationForm
-from .utils import generate_certificate_pdf
+from .utils import (
+    build_pdf_response, certificate_pdf_validators, get_certificate_pdf_bytes,
+    stream_certificates_zip, write_print_pack,
+)
+from .settings_cache import get_system_settings
+from .pagination import KeysetPaginationMixin
+from .search import search_projects
+from . import pdf_jobs
 
 logger = logging.getLogger(__name__)
 
@@ -45,24 +59,51 @@ def register(request):
     return render(request, 'registration/register.html', {'form': form})
 
 
-class ProjectListView(LoginRequiredMixin, ListView):
+class OwnerRequiredMixin(UserPassesTestMixin):
+    """
+    Only lets the owner of the view's object through.
+
+    The object is fetched once per request, with whatever select_related
+    get_queryset() sets up, and the same instance is handed to test_func,
+    get/post and the template. owner_path is the dotted attribute path from
+    the object to its owner's id.
+    """
+    owner_path = 'owner_id'
+
+    def get_object(self, queryset=None):
+        if queryset is not None:
+            return super().get_object(queryset)
+        if not hasattr(self, '_object'):
+            self._object = super().get_object()
+        return self._object
+
+    def test_func(self):
+        value = self.get_object()
+        for attribute in self.owner_path.split('.'):
+            value = getattr(value, attribute)
+        return value == self.request.user.pk
+
+
+class ProjectListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Project
     template_name = 'certificates/project_list.html'
     context_object_name = 'projects'
     paginate_by = 12
+    # Served by the (owner, -created_at) index
+    keyset_ordering = ['-created_at', '-pk']
 
     def get_queryset(self):
-        return Project.objects.filter(owner=self.request.user).select_related('owner')
+        # Card figures are annotated so the page costs the same however many projects it shows
+        return Project.objects.filter(owner=self.request.user).with_summary()
 
 
-class ProjectDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+class ProjectDetailView(LoginRequiredMixin, OwnerRequiredMixin, DetailView):
     model = Project
     template_name = 'certificates/project_detail.html'
     context_object_name = 'project'
 
-    def test_func(self):
-        project = self.get_object()
-        return project.owner == self.request.user
+    def get_queryset(self):
+        return Project.objects.select_related('ledger')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -94,15 +135,11 @@ class ProjectCreateView(LoginRequiredMixin, CreateView):
         return context
 
 
-class ProjectUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class ProjectUpdateView(LoginRequiredMixin, OwnerRequiredMixin, UpdateView):
     model = Project
     form_class = ProjectForm
     template_name = 'certificates/project_form.html'
 
-    def test_func(self):
-        project = self.get_object()
-        return project.owner == self.request.user
-
     def form_valid(self, form):
         try:
             response = super().form_valid(form)
@@ -120,15 +157,11 @@ class ProjectUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return context
 
 
-class ProjectDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class ProjectDeleteView(LoginRequiredMixin, OwnerRequiredMixin, DeleteView):
     model = Project
     template_name = 'certificates/project_confirm_delete.html'
     success_url = reverse_lazy('project_list')
 
-    def test_func(self):
-        project = self.get_object()
-        return project.owner == self.request.user
-
     def delete(self, request, *args, **kwargs):
         try:
             project = self.get_object()
@@ -148,16 +181,22 @@ class CertificateCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView)
     form_class = CertificateForm
     template_name = 'certificates/certificate_form.html'
 
+    def get_project(self):
+        # Looked up once and shared by test_func, form_valid and the template
+        if not hasattr(self, '_project'):
+            self._project = get_object_or_404(Project, pk=self.kwargs['project_pk'])
+        return self._project
+
     def test_func(self):
-        project = get_object_or_404(Project, pk=self.kwargs['project_pk'])
-        return project.owner == self.request.user
+        return self.get_project().owner_id == self.request.user.pk
 
     def form_valid(self, form):
         try:
             with transaction.atomic():
-                project = get_object_or_404(Project, pk=self.kwargs['project_pk'])
+                project = self.get_project()
                 form.instance.project = project
                 response = super().form_valid(form)
+                pdf_jobs.schedule_prerender(self.object.pk)
                 messages.success(self.request, 'Certificate created successfully!')
                 logger.info(f'Certificate created for project {project.contract_no} by {self.request.user.username}')
                 return response
@@ -168,8 +207,9 @@ class CertificateCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['project'] = get_object_or_404(Project, pk=self.kwargs['project_pk'])
+        context['project'] = self.get_project()
         context['title'] = 'Create New Certificate'
+        context['vat_rate'], context['retention_rate'] = get_calculation_rates()
         return context
 
     def get_success_url(self):
@@ -179,20 +219,22 @@ class CertificateCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView)
         })
 
 
-class CertificateDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+class CertificateDetailView(LoginRequiredMixin, OwnerRequiredMixin, DetailView):
     model = Certificate
     template_name = 'certificates/certificate_detail.html'
     context_object_name = 'certificate'
+    owner_path = 'project.owner_id'
 
-    def test_func(self):
-        certificate = self.get_object()
-        return certificate.project.owner == self.request.user
+    def get_queryset(self):
+        # Project and calculations arrive with the certificate in a single query
+        return Certificate.objects.select_related('project').with_calculations()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['project'] = self.object.project
+        context['vat_rate'], context['retention_rate'] = get_calculation_rates()
         try:
-            context['calculations'] = self.object.calculations
+            context['calculations'] = self.object.get_calculations()
         except Calculations.DoesNotExist:
             logger.warning(f'Calculations not found for certificate {self.object.pk}')
             context['calculations'] = None
@@ -204,21 +246,42 @@ def certificate_pdf(request, project_pk, pk):
     """Generate PDF for certificate"""
     try:
         project = get_object_or_404(Project, pk=project_pk)
-        certificate = get_object_or_404(Certificate, pk=pk, project=project)
+        certificate = get_object_or_404(Certificate.objects.with_calculations(), pk=pk, project=project)
         
         # Check permissions
         if certificate.project.owner != request.user:
             raise PermissionDenied("You don't have permission to access this certificate.")
         
         try:
-            calculations = certificate.calculations
+            calculations = certificate.get_calculations()
         except Calculations.DoesNotExist:
             logger.error(f'Calculations not found for certificate {certificate.pk}')
             messages.error(request, 'Certificate calculations not found.')
             return redirect('certificate_detail', project_pk=project_pk, pk=pk)
         
+        # Opt-in background rendering: queue a job and let the client poll for it
+        if request.GET.get('async'):
+            job = pdf_jobs.enqueue(certificate, request.user)
+            logger.info(f'PDF job {job.pk} queued for certificate {certificate.pk} by {request.user.username}')
+            return JsonResponse(_pdf_job_payload(job), status=202)
+        
+        # Answer conditional requests from the timestamps alone, without rendering
+        system_settings = get_system_settings()
+        etag, last_modified = certificate_pdf_validators(project, certificate, system_settings)
+        validators = HttpResponse()
+        validators['ETag'] = etag
+        validators['Last-Modified'] = http_date(last_modified.timestamp())
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified.timestamp()), response=validators
+        )
+        if not_modified is not validators:
+            return not_modified
+        
         # Generate PDF
-        response = generate_certificate_pdf(project, certificate, calculations)
+        pdf = get_certificate_pdf_bytes(project, certificate, calculations, system_settings)
+        response = build_pdf_response(
+            request, pdf, f'certificate_{certificate.id}.pdf', etag=etag, last_modified=last_modified
+        )
         logger.info(f'PDF generated for certificate {certificate.pk} by {request.user.username}')
         return response
         
@@ -228,6 +291,223 @@ def certificate_pdf(request, project_pk, pk):
         return redirect('certificate_detail', project_pk=project_pk, pk=pk)
 
 
+def _pdf_job_payload(job):
+    payload = {
+        'id': job.pk,
+        'status': job.status,
+        'status_url': reverse('pdf_job_status', kwargs={'pk': job.pk}),
+        'download_url': None,
+    }
+    if job.status == 'DONE':
+        payload['download_url'] = reverse('pdf_job_download', kwargs={'pk': job.pk})
+    elif job.status == 'FAILED':
+        payload['error'] = 'PDF generation failed.'
+    return payload
+
+
+def _get_owned_pdf_job(request, pk):
+    job = get_object_or_404(PdfRenderJob.objects.select_related('certificate__project'), pk=pk)
+    if job.certificate.project.owner != request.user:
+        raise PermissionDenied("You don't have permission to access this certificate.")
+    return job
+
+
+@login_required
+def pdf_job_status(request, pk):
+    """Poll the status of a queued PDF render"""
+    job = _get_owned_pdf_job(request, pk)
+    return JsonResponse(_pdf_job_payload(job))
+
+
+@login_required
+def pdf_job_download(request, pk):
+    """Download the output of a finished PDF render"""
+    job = _get_owned_pdf_job(request, pk)
+    if job.status != 'DONE' or not job.pdf_file:
+        raise Http404("PDF is not ready yet.")
+    return FileResponse(
+        job.pdf_file.open('rb'),
+        as_attachment=True,
+        filename=f'certificate_{job.certificate_id}.pdf',
+        content_type='application/pdf'
+    )
+
+
+@login_required
+def project_certificates_zip(request, project_pk):
+    """Download every certificate PDF of a project as a single ZIP"""
+    project = get_object_or_404(Project, pk=project_pk)
+    if project.owner != request.user:
+        raise PermissionDenied("You don't have permission to access this project.")
+
+    certificates = project.certificates.with_calculations().order_by('pk')
+    response = StreamingHttpResponse(
+        stream_certificates_zip(project, certificates.iterator(chunk_size=100)),
+        content_type='application/zip'
+    )
+    response['Content-Disposition'] = f'attachment; filename="certificates_{project.contract_no}.zip"'
+    logger.info(f'Certificate ZIP requested for project {project.contract_no} by {request.user.username}')
+    return response
+
+
+@login_required
+def certificate_print_pack(request):
+    """Single PDF with every certificate the user owns created in a date range"""
+    try:
+        start = parse_date(request.GET.get('start', ''))
+        end = parse_date(request.GET.get('end', ''))
+        project_pk = int(request.GET['project']) if request.GET.get('project') else None
+    except ValueError:
+        # A well-formed but impossible date (2024-02-30) or a project id that is not a number
+        start = end = None
+    if not start or not end or start > end:
+        messages.error(request, 'Please choose a valid date range for the print pack.')
+        return redirect('project_list')
+
+    certificates = Certificate.objects.filter(
+        project__owner=request.user,
+        created_at__date__gte=start,
+        created_at__date__lte=end
+    ).select_related('project').with_calculations().order_by('created_at', 'pk')
+
+    if project_pk is not None:
+        certificates = certificates.filter(project_id=project_pk)
+
+    # Spool to disk so the pack never has to fit in memory
+    output = tempfile.TemporaryFile()
+    try:
+        count = write_print_pack(output, certificates.iterator(chunk_size=200))
+    except Exception as e:
+        output.close()
+        logger.error(f'Print pack generation error: {str(e)}')
+        messages.error(request, 'Failed to generate print pack. Please try again.')
+        return redirect('project_list')
+
+    output.seek(0)
+    logger.info(f'Print pack of {count} certificates generated by {request.user.username}')
+    return FileResponse(
+        output,
+        as_attachment=True,
+        filename=f'certificates_{start:%Y%m%d}_{end:%Y%m%d}.pdf',
+        content_type='application/pdf'
+    )
+
+
+MAX_BULK_CERTIFICATES = 1000
+
+
+def _replay_bulk_request(previous, project, request_hash):
+    """The stored response for a retried key, or 422 if the key was used for a different request"""
+    # Rows stored before request_hash existed can only be checked against the project
+    if previous.project_id != project.pk or (previous.request_hash and previous.request_hash != request_hash):
+        return JsonResponse(
+            {'error': 'This Idempotency-Key was already used for a different request.'}, status=422
+        )
+    return JsonResponse(previous.response, status=201)
+
+
+@login_required
+@require_POST
+def certificate_bulk_create(request, project_pk):
+    """Create many certificates for a project from a JSON batch"""
+    project = get_object_or_404(Project, pk=project_pk)
+    if project.owner != request.user:
+        raise PermissionDenied("You don't have permission to access this project.")
+
+    try:
+        body = json.loads(request.body)
+        rows = body['certificates']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected a JSON object with a "certificates" list.'}, status=400)
+
+    idempotency_key = request.headers.get('Idempotency-Key', '').strip()
+    # Key order and whitespace don't make a different request
+    request_hash = hashlib.sha256(json.dumps(body, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+    if idempotency_key:
+        previous = BulkCertificateRequest.objects.filter(user=request.user, idempotency_key=idempotency_key).first()
+        if previous:
+            return _replay_bulk_request(previous, project, request_hash)
+
+    if not isinstance(rows, list) or not rows:
+        return JsonResponse({'error': '"certificates" must be a non-empty list.'}, status=400)
+    if len(rows) > MAX_BULK_CERTIFICATES:
+        return JsonResponse({'error': f'At most {MAX_BULK_CERTIFICATES} certificates per request.'}, status=400)
+
+    # Validate the whole batch before writing anything
+    certificates = []
+    errors = {}
+    for index, row in enumerate(rows):
+        form = CertificateForm(data=row if isinstance(row, dict) else {})
+        if form.is_valid():
+            certificate = form.save(commit=False)
+            certificate.project = project
+            certificates.append(certificate)
+        else:
+            errors[index] = form.errors.get_json_data()
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+
+    try:
+        with transaction.atomic():
+            created = Certificate.objects.bulk_create_with_calculations(certificates)
+            payload = {'created': len(created), 'ids': [certificate.pk for certificate in created]}
+            if idempotency_key:
+                BulkCertificateRequest.objects.create(
+                    user=request.user,
+                    project=project,
+                    idempotency_key=idempotency_key,
+                    request_hash=request_hash,
+                    response=payload
+                )
+    except IntegrityError:
+        # A concurrent retry with the same key won the race; replay its result
+        previous = BulkCertificateRequest.objects.filter(user=request.user, idempotency_key=idempotency_key).first()
+        if previous is None:
+            raise
+        return _replay_bulk_request(previous, project, request_hash)
+
+    logger.info(f'{len(created)} certificates bulk created for project {project.contract_no} by {request.user.username}')
+    return JsonResponse(payload, status=201)
+
+
+SEARCH_PAGE_SIZE = 12
+
+
+@login_required
+def project_search(request):
+    """Ranked search over the user's projects; ?format=json returns the matches as JSON"""
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    projects, has_next = search_projects(request.user, query, page=page, per_page=SEARCH_PAGE_SIZE)
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'query': query,
+            'page': page,
+            'has_next': has_next,
+            'results': [
+                {
+                    'id': project.pk,
+                    'name_of_contractor': project.name_of_contractor,
+                    'contract_no': project.contract_no,
+                    'vote_no': project.vote_no,
+                    'url': reverse('project_detail', args=[project.pk]),
+                }
+                for project in projects
+            ],
+        })
+
+    return render(request, 'certificates/project_search.html', {
+        'query': query,
+        'projects': projects,
+        'page': page,
+        'has_next': has_next,
+    })
+
+
 # Function-based views for backward compatibility
 project_list = ProjectListView.as_view()
 project_detail = ProjectDetailView.as_view()
@@ -79,6 +79,10 @@ if DEBUG and not os.environ.get('DB_NAME'):
         }
     }
 
+# Trigram lookups for project search (certificates/search.py)
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    INSTALLED_APPS.append('django.contrib.postgres')
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -115,6 +119,77 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Backups saved on the server, with their manifests (certificates/backup.py).
+# Outside MEDIA_ROOT, so a full database dump is never served as a media file
+BACKUP_DIR = Path(os.environ.get('BACKUP_DIR', BASE_DIR / 'backups'))
+
+# Rendered certificate PDF cache
+PDF_CACHE_DIR = Path(os.environ.get('PDF_CACHE_DIR', BASE_DIR / 'cache' / 'pdf'))
+PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# Recalculate existing certificates in the process_recalculation_jobs worker when
+# rates change (False runs the queued job in the request, after it commits)
+CERTIFICATE_RECALCULATION_ASYNC = True
+# A running recalculation with no finished batch for this long is retried
+RECALCULATION_JOB_TIMEOUT_SECONDS = int(os.environ.get('RECALCULATION_JOB_TIMEOUT_SECONDS', 600))
+RECALCULATION_JOB_MAX_ATTEMPTS = int(os.environ.get('RECALCULATION_JOB_MAX_ATTEMPTS', 3))
+
+# 'stored' keeps a Calculations row per certificate; 'computed' derives the
+# values in the database on read (see Certificate.get_calculations and the
+# set_calculations_mode command for switching over)
+CALCULATIONS_MODE = os.environ.get('CALCULATIONS_MODE', 'stored')
+
+# Extra TTF fonts registered for PDFs, as {'FontName': '/path/to/font.ttf'}
+PDF_FONTS = {}
+
+# Queued PDF jobs (certificates/pdf_jobs.py): a job RUNNING longer than the
+# timeout is retried, up to the attempt limit; finished jobs and their files
+# are deleted after the retention period
+PDF_JOB_TIMEOUT_SECONDS = int(os.environ.get('PDF_JOB_TIMEOUT_SECONDS', 600))
+PDF_JOB_MAX_ATTEMPTS = int(os.environ.get('PDF_JOB_MAX_ATTEMPTS', 3))
+PDF_JOB_RETENTION_DAYS = int(os.environ.get('PDF_JOB_RETENTION_DAYS', 7))
+
+# Background pre-rendering of new certificates (0 renders inline)
+PDF_PRERENDER_WORKERS = int(os.environ.get('PDF_PRERENDER_WORKERS', 2))
+
+# Buffered audit log writes (certificates/audit.py): a batch is written every
+# AUDIT_FLUSH_EVENTS entries or AUDIT_FLUSH_INTERVAL_MS, and an entry that
+# cannot be written is retried up to AUDIT_MAX_ATTEMPTS times. TEST_RUNNER
+# turns AUDIT_ASYNC off so tests see each entry as soon as it is recorded.
+AUDIT_ASYNC = os.environ.get('AUDIT_ASYNC', '1') == '1'
+AUDIT_FLUSH_EVENTS = int(os.environ.get('AUDIT_FLUSH_EVENTS', 100))
+AUDIT_FLUSH_INTERVAL_MS = int(os.environ.get('AUDIT_FLUSH_INTERVAL_MS', 1000))
+AUDIT_MAX_ATTEMPTS = int(os.environ.get('AUDIT_MAX_ATTEMPTS', 5))
+
+TEST_RUNNER = 'certificates.test_runner.TestRunner'
+
+# Carries the SystemSettings version token (certificates/settings_cache.py), so
+# it must be shared by every worker that serves the site. The file-based
+# default is only shared by workers on this host: a deployment on more than
+# one host MUST set REDIS_URL (`manage.py check --deploy` warns otherwise).
+# Tests use a local-memory cache instead (certificates/test_runner.py).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / 'cache' / 'django',
+        }
+    }
+
+# Longest a worker keeps using SystemSettings after another worker saves them
+SYSTEM_SETTINGS_RECHECK_SECONDS = int(os.environ.get('SYSTEM_SETTINGS_RECHECK_SECONDS', 2))
+
+# Delta exports stop this far behind the clock, so rows from transactions still
+# open during an export are picked up by the next one (certificates/exports.py)
+EXPORT_WATERMARK_LAG_SECONDS = int(os.environ.get('EXPORT_WATERMARK_LAG_SECONDS', 60))
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 